@@ -0,0 +1,179 @@
+import re
+
+MAX_INPUT_LENGTH = 2000
+MAX_DEPTH = 4
+MAX_ELEMENTS = 64
+MAX_NUMBER_LENGTH = 32
+
+ESCAPES = {
+    "n": "\n", "t": "\t", "r": "\r", "0": "\0",
+    "\\": "\\", "'": "'", '"': '"'
+}
+CONSTANTS = {"True": True, "False": False, "None": None}
+CLOSING = {"(": ")", "[": "]", "{": "}"}
+STRING_PATTERNS = {
+    quote: re.compile(
+        quote + r"([^\\\n{0}]*(?:\\.[^\\\n{0}]*)*)".format(quote) + quote
+    )
+    for quote in ("'", '"')
+}
+ESCAPE_PATTERN = re.compile(r"\\(.)")
+NUMBER_PATTERN = re.compile(r"[-+]?[0-9_.]+(?:[eE][-+]?[0-9_]+)?")
+WHITESPACE_PATTERN = re.compile(r"\s*")
+
+class ArgumentError(ValueError):
+    def __init__(self, reason, position=None):
+        self.reason = reason
+        self.position = position
+        if position is None:
+            super().__init__(reason)
+        else:
+            super().__init__(f"{reason} (at position {position})")
+
+class ArgumentParser:
+    # Single pass recursive descent over the literals commands actually
+    # take: strings, numbers, True/False/None, tuples, lists and dicts.
+    # Nesting and the total element count are capped, so any input is
+    # parsed (or rejected) in time linear in its length.
+    def __init__(self, text, max_depth=MAX_DEPTH, max_elements=MAX_ELEMENTS):
+        self.text = text
+        self.pos = 0
+        self.max_depth = max_depth
+        self.max_elements = max_elements
+        self.elements = 0
+
+    def error(self, reason):
+        raise ArgumentError(reason, self.pos)
+
+    def skip_whitespace(self):
+        self.pos = WHITESPACE_PATTERN.match(self.text, self.pos).end()
+
+    def peek(self):
+        self.skip_whitespace()
+        return self.text[self.pos] if self.pos < len(self.text) else ""
+
+    def expect(self, char):
+        if self.peek() != char:
+            self.error(f"Expected '{char}'")
+        self.pos += 1
+
+    def count_element(self):
+        self.elements += 1
+        if self.elements > self.max_elements:
+            self.error(f"More than {self.max_elements} elements")
+
+    def parse_value(self, depth):
+        char = self.peek()
+        if char in ("'", '"'):
+            value = self.parse_string()
+            # Adjacent literals are joined, like in Python.
+            while self.peek() in ("'", '"'):
+                value += self.parse_string()
+            return value
+        elif char in CLOSING:
+            if depth >= self.max_depth:
+                self.error(f"Nesting deeper than {self.max_depth}")
+            return self.parse_container(depth + 1)
+        elif char.isdigit() or char in ("-", "+", "."):
+            return self.parse_number()
+        elif char.isalpha():
+            return self.parse_constant()
+        elif not char:
+            self.error("Unexpected end of arguments")
+        else:
+            self.error(f"Unexpected character {char!r}")
+
+    def parse_string(self):
+        match = STRING_PATTERNS[self.text[self.pos]].match(self.text, self.pos)
+        if match is None:
+            self.error("Unterminated string")
+        self.pos = match.end()
+        body = match.group(1)
+        if "\\" in body:
+            body = ESCAPE_PATTERN.sub(self.unescape, body)
+        return body
+
+    def unescape(self, match):
+        if match.group(1) not in ESCAPES:
+            self.error(f"Unsupported escape '\\{match.group(1)}'")
+        return ESCAPES[match.group(1)]
+
+    def parse_number(self):
+        match = NUMBER_PATTERN.match(self.text, self.pos)
+        literal = match.group() if match is not None else self.text[self.pos]
+        if len(literal) > MAX_NUMBER_LENGTH:
+            self.error("Number literal too long")
+        try:
+            if any(c in literal for c in ".eE"):
+                value = float(literal)
+            else:
+                value = int(literal)
+        except ValueError:
+            self.error(f"Invalid number {literal!r}")
+        self.pos += len(literal)
+        return value
+
+    def parse_constant(self):
+        text = self.text
+        start = self.pos
+        while self.pos < len(text) and (text[self.pos].isalnum() or text[self.pos] == "_"):
+            self.pos += 1
+        name = text[start:self.pos]
+        if name not in CONSTANTS:
+            self.pos = start
+            self.error(f"Unknown name {name!r}")
+        return CONSTANTS[name]
+
+    def parse_container(self, depth):
+        opening = self.text[self.pos]
+        closing = CLOSING[opening]
+        self.pos += 1
+        items, trailing_comma = self.parse_sequence(depth, closing, pairs=opening == "{")
+        if opening == "(" and len(items) == 1 and not trailing_comma:
+            # Just parentheses around a value, not a tuple.
+            return items[0]
+        elif opening == "{":
+            try:
+                return dict(items)
+            except TypeError:
+                self.error("Unhashable dictionary key")
+        elif opening == "[":
+            return items
+        return tuple(items)
+
+    def parse_sequence(self, depth, closing, pairs=False):
+        items = []
+        trailing_comma = False
+        while True:
+            if self.peek() == closing:
+                self.pos += 1
+                return items, trailing_comma
+            self.count_element()
+            value = self.parse_value(depth)
+            if pairs:
+                self.expect(":")
+                value = (value, self.parse_value(depth))
+            items.append(value)
+            char = self.peek()
+            trailing_comma = char == ","
+            if trailing_comma:
+                self.pos += 1
+            elif char != closing:
+                self.error(f"Expected ',' or '{closing}'" if closing else "Expected ','")
+
+def parse_call_arguments(instr, max_length=MAX_INPUT_LENGTH):
+    # Like the `(spam, eggs, {"key": value})` tail of a Python call: the
+    # text between the first "(" and the last ")" is a tuple of arguments,
+    # a trailing dict holds the keyword arguments.
+    if len(instr) > max_length:
+        raise ArgumentError(f"Arguments longer than {max_length} characters")
+    left = instr.find("(")
+    right = instr.rfind(")")
+    if left == -1 or right < left:
+        raise ArgumentError("Expected an argument list in parentheses")
+    parser = ArgumentParser(instr[:right])
+    parser.pos = left + 1
+    args = tuple(parser.parse_sequence(1, "")[0])
+    if args and isinstance(args[-1], dict):
+        return args[:-1], args[-1]
+    return args, {}
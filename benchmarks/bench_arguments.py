@@ -0,0 +1,60 @@
+import ast
+import sys
+import timeit
+
+import arguments
+
+# Run from the repository root: python -m benchmarks.bench_arguments
+
+def literal_eval_find_args(instr):
+    # What CommandHandler.command_find_args used to do.
+    left = instr.find('(')
+    right = instr.rfind(')')
+    if right - left > 1:
+        back = ",)"
+    elif ")" in instr:
+        back = ")"
+    else:
+        back = ""
+    args = ast.literal_eval(instr[left:right] + back)
+    if args and isinstance(args[-1], dict):
+        kwargs = args[-1]
+        args = args[:-1]
+    else:
+        kwargs = {}
+    return args, kwargs
+
+CASES = {
+    "small": '&addpoll("Yes", "No")',
+    "typical": '&addpoll("Pizza", "Pasta", "Sushi", "Tacos", "Curry", {"title": "Dinner?"})',
+    "max options": "&addpoll(" + ", ".join(f'"Option number {i}"' for i in range(35)) + ")",
+    "long strings": "&addpoll(" + ", ".join('"' + "x" * 400 + '"' for _ in range(4)) + ")",
+    "nested (hostile)": "&addpoll(" + "(" * 90 + "1" + ")" * 90 + ")",
+    "huge (hostile)": "&addpoll(" + ", ".join(["1"] * 5000) + ")",
+}
+
+def run(parse, instr, number):
+    try:
+        parse(instr)
+    except (SyntaxError, ValueError, MemoryError, RecursionError) as e:
+        outcome = type(e).__name__
+    else:
+        outcome = "ok"
+    seconds = timeit.timeit(lambda: _attempt(parse, instr), number=number)
+    return outcome, seconds / number * 1e6
+
+def _attempt(parse, instr):
+    try:
+        parse(instr)
+    except (SyntaxError, ValueError, MemoryError, RecursionError):
+        pass
+
+def main(number=2000):
+    print(f"{'case':<18} {'length':>6}  {'literal_eval':>22}  {'ArgumentParser':>22}")
+    for name, instr in CASES.items():
+        old, old_us = run(literal_eval_find_args, instr, number)
+        new, new_us = run(arguments.parse_call_arguments, instr, number)
+        print(f"{name:<18} {len(instr):>6}  {old_us:>9.1f}us {old:>11}  {new_us:>9.1f}us {new:>11}")
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,65 @@
+import json
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import caching
+import storage
+from benchmarks import replay
+
+# Run from the repository root: python -m benchmarks.bench_cache_encoding [polls]
+# Compares the poll cache formats: references nested into every poll (what
+# the cache used to be) against the interned object table, both indented
+# and compact. "load" is parsing plus expanding the references, "loaded"
+# the memory the decoded polls take up.
+
+def encode_nested(seq, dlist, compact=False):
+    return json.dumps(
+        {"journal_seq": seq, "polls": dlist},
+        cls=caching.DiscordSupportJSONEncoder,
+        sort_keys=True, indent=None if compact else 4,
+        separators=(",", ":") if compact else None
+    )
+
+FORMATS = {
+    "nested, indented": lambda dlist: encode_nested(0, dlist),
+    "nested, compact": lambda dlist: encode_nested(0, dlist, compact=True),
+    "interned, indented": lambda dlist: storage.encode_poll_snapshot(0, dlist),
+    "interned, compact": lambda dlist: storage.encode_poll_snapshot(0, dlist, compact=True),
+}
+
+def best_of(func, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+def loaded_size(data):
+    tracemalloc.start()
+    try:
+        polls = storage.decode_poll_snapshot(data)
+        return tracemalloc.get_traced_memory()[0]
+    finally:
+        del polls
+        tracemalloc.stop()
+
+def main(polls=5000):
+    with tempfile.TemporaryDirectory() as directory:
+        world = replay.Bench(directory).world
+        dlist = replay.generate_poll_caches(world, polls)
+    print(f"{polls} polls, {len(world.channels)} channels, {len(world.users)} users")
+    print(f"{'format':<20} {'size':>10} {'encode':>9} {'load':>9} {'loaded':>10}")
+    for name, encode in FORMATS.items():
+        data, encode_time = best_of(lambda: encode(dlist))
+        (seq, decoded), load_time = best_of(lambda: storage.decode_poll_snapshot(data))
+        assert len(decoded) == polls
+        size = len(data.encode("utf-8"))
+        print(f"{name:<20} {size / 2**20:>8.2f}MB {encode_time*1000:>7.1f}ms "
+              f"{load_time*1000:>7.1f}ms {loaded_size(data) / 2**20:>8.2f}MB")
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
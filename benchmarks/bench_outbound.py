@@ -0,0 +1,204 @@
+import asyncio
+import sys
+import time
+
+import outbound
+from benchmarks import fakes
+
+# Run from the repository root: python -m benchmarks.bench_outbound [scale]
+# `scale` shrinks every rate limit window, 0.1 makes a 0.25s bucket 25ms.
+# The scheduler's behaviour is checked first (priorities, 429s, pacing,
+# draining), then the inline and scheduled paths are timed.
+
+OPTIONS = 35
+REACTIONS = [chr(0x1F1E6 + i) for i in range(OPTIONS)]
+
+def setup(scale):
+    rate_limits = fakes.FakeRateLimits(outbound.ROUTE_LIMITS, scale=scale)
+    client = fakes.FakeDiscordClient(latency=0.002, rate_limits=rate_limits)
+    server = fakes.FakeServer()
+    server.me = fakes.FakeUser(name="helix", server=server)
+    channel = fakes.FakeChannel(server)
+    return client, channel
+
+async def inline_add_poll(client, channel):
+    # The old add_poll: every reaction awaited in turn, 429s retried.
+    message = await fakes.call_with_retries(client, "send_message", channel, "poll")
+    for emoji in REACTIONS:
+        await fakes.call_with_retries(client, "add_reaction", message, emoji)
+    return message
+
+async def scheduled_add_poll(scheduler, channel):
+    message = await scheduler.send_message(channel, "poll")
+    for emoji in REACTIONS:
+        scheduler.fire("add_reaction", message, emoji, priority=outbound.PRIORITY_DECORATION)
+    return message
+
+class RecordingClient(fakes.FakeDiscordClient):
+    # Notes every call as it actually goes out, with its text and when.
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.log = []
+
+    async def _request(self, method, target):
+        self.log.append((method, target, time.monotonic()))
+        await super()._request(method, target)
+
+    def sent(self, method):
+        return [entry for entry in self.log if entry[0] == method]
+
+def scaled_scheduler(client, scale, **overrides):
+    limits = dict(outbound.ROUTE_LIMITS, **overrides)
+    return outbound.OutboundScheduler(client, {
+        method: (limit, per * scale) for method, (limit, per) in limits.items()
+    }, global_limit=(outbound.GLOBAL_LIMIT[0], outbound.GLOBAL_LIMIT[1] * scale))
+
+def recording_setup(scale, **limits):
+    rate_limits = fakes.FakeRateLimits(dict(outbound.ROUTE_LIMITS, **limits), scale=scale)
+    client = RecordingClient(rate_limits=rate_limits)
+    server = fakes.FakeServer()
+    server.me = fakes.FakeUser(name="helix", server=server)
+    return client, server
+
+async def check_priorities(scale):
+    # A route's queue lets replies (command output, vote confirmations)
+    # jump live edits queued before them, and so does the global gate
+    # across routes.
+    client, server = recording_setup(scale, edit_message=(1, 0.5))
+    scheduler = scaled_scheduler(client, scale, edit_message=(1, 0.5))
+    client.rate_limits.listeners.append(scheduler.update_bucket)
+    channel = fakes.FakeChannel(server)
+    message = await client.send_message(channel, "poll")
+    order = []
+    def edit(text, priority):
+        future = scheduler.edit_message(message, text, priority=priority)
+        future.add_done_callback(lambda _: order.append(text))
+        return future
+    live = [edit(f"live {i}", outbound.PRIORITY_EDIT) for i in range(3)]
+    await asyncio.sleep(0)
+    reply = edit("reply", outbound.PRIORITY_REPLY)
+    await asyncio.gather(reply, *live)
+    assert len(client.sent("edit_message")) == 4 and client.rate_limits.rejected == 0
+    # The first live edit was already on its way, the reply overtook the rest.
+    assert order == ["live 0", "reply", "live 1", "live 2"], order
+
+    client, server = recording_setup(scale)
+    scheduler = outbound.OutboundScheduler(client, global_limit=(1, 0.5 * scale))
+    first, second, third = (fakes.FakeChannel(server) for _ in range(3))
+    message = await client.send_message(first, "poll")
+    client.log.clear()
+    busy = scheduler.send_message(third, "busy")
+    edit = scheduler.edit_message(message, "live", priority=outbound.PRIORITY_EDIT)
+    vote = scheduler.send_message(second, "vote counted")
+    await asyncio.gather(busy, edit, vote)
+    order = [target for _, target, _ in client.log]
+    assert order == [third, second, message], "the global gate ignored priorities"
+
+async def check_rate_limited(scale):
+    # Discord's bucket is tighter than the scheduler assumes. Without
+    # headers the first 429 fails that request and empties the route's
+    # bucket, the next request waits the window out instead of hitting
+    # another 429. With headers there's no 429 at all.
+    for headers in (False, True):
+        client, server = recording_setup(scale, edit_message=(1, 0.5))
+        scheduler = scaled_scheduler(client, scale, edit_message=(5, 0.5))
+        if headers:
+            client.rate_limits.listeners.append(scheduler.update_bucket)
+        message = await client.send_message(fakes.FakeChannel(server), "poll")
+        await asyncio.sleep(0.5 * scale)
+        edits = [scheduler.edit_message(message, f"edit {i}") for i in range(3)]
+        results = await asyncio.gather(*edits, return_exceptions=True)
+        failed = [r for r in results if isinstance(r, Exception)]
+        if headers:
+            assert not failed and client.rate_limits.rejected == 0
+            assert scheduler.rate_limited == 0 and scheduler.delayed == 2
+        else:
+            assert [outbound.response_status(e) for e in failed] == [429]
+            assert results[0] is message and results[2] is message
+            assert scheduler.rate_limited == client.rate_limits.rejected == 1
+            assert scheduler.delayed >= 1
+        assert message.content == "edit 2"
+
+async def check_pacing(scale):
+    # Each route keeps to its own bucket, routes in other channels aren't
+    # held up by it.
+    per = outbound.ROUTE_LIMITS["add_reaction"][1] * scale
+    client, server = recording_setup(scale)
+    scheduler = scaled_scheduler(client, scale)
+    client.rate_limits.listeners.append(scheduler.update_bucket)
+    messages = [
+        await client.send_message(fakes.FakeChannel(server), "poll") for _ in range(2)
+    ]
+    client.log.clear()
+    start = time.monotonic()
+    await asyncio.gather(*(
+        scheduler.add_reaction(message, emoji)
+        for message in messages for emoji in REACTIONS[:5]
+    ))
+    assert client.rate_limits.rejected == 0
+    for message in messages:
+        times = [at for _, target, at in client.log if target is message]
+        assert len(times) == 5
+        gaps = [later - earlier for earlier, later in zip(times, times[1:])]
+        assert min(gaps) >= per * 0.9, f"reactions {min(gaps)*1000:.1f}ms apart"
+    # Both channels went at the same time, not one after the other.
+    assert time.monotonic() - start < per * 7
+
+async def check_drain(scale):
+    # What shutdown does: close the live edits, which fires whatever is
+    # still pending, then drain the scheduler; nothing is left behind.
+    client, server = recording_setup(scale)
+    scheduler = scaled_scheduler(client, scale)
+    client.rate_limits.listeners.append(scheduler.update_bucket)
+    message = await client.send_message(fakes.FakeChannel(server), "poll")
+    for emoji in REACTIONS[:5]:
+        scheduler.fire("add_reaction", message, emoji, priority=outbound.PRIORITY_DECORATION)
+    live = outbound.LiveEditScheduler(scheduler, lambda text: text)
+    live.mark(message, "final count")
+    live.close()
+    await scheduler.drain()
+    assert not scheduler.workers and not scheduler.queues
+    assert message.content == "final count"
+    assert len(message.reactions) == 5 and client.rate_limits.rejected == 0
+
+CHECKS = (check_priorities, check_rate_limited, check_pacing, check_drain)
+
+async def measure(scale, scheduled):
+    client, channel = setup(scale)
+    # Discord's actual windows are a bit longer than the defaults assume,
+    # headers are the only way the scheduler gets to know that.
+    client.rate_limits.limits["add_reaction"] = (1, 0.3 * scale)
+    scheduler = outbound.OutboundScheduler(client, {
+        method: (limit, per * scale) for method, (limit, per) in outbound.ROUTE_LIMITS.items()
+    }, global_limit=(outbound.GLOBAL_LIMIT[0], outbound.GLOBAL_LIMIT[1] * scale))
+    client.rate_limits.listeners.append(scheduler.update_bucket)
+    start = time.monotonic()
+    if scheduled:
+        message = await scheduled_add_poll(scheduler, channel)
+    else:
+        message = await inline_add_poll(client, channel)
+    returned = time.monotonic() - start
+    reply_start = time.monotonic()
+    if scheduled:
+        await scheduler.send_message(channel, "results")
+    else:
+        await fakes.call_with_retries(client, "send_message", channel, "results")
+    reply = time.monotonic() - reply_start
+    await scheduler.drain()
+    done = time.monotonic() - start
+    assert len(message.reactions) == OPTIONS
+    return returned, reply, done, client.rate_limits.rejected
+
+def main(scale=0.1):
+    loop = asyncio.get_event_loop()
+    for check in CHECKS:
+        loop.run_until_complete(check(scale))
+    print(f"{len(CHECKS)} scheduler checks passed")
+    print(f"{OPTIONS}-option poll, rate limit windows scaled by {scale}")
+    print(f"{'path':<10} {'command':>9} {'reply':>9} {'all done':>9} {'429s':>5}")
+    for name, scheduled in (("inline", False), ("scheduled", True)):
+        returned, reply, done, rejected = loop.run_until_complete(measure(scale, scheduled))
+        print(f"{name:<10} {returned*1000:>7.1f}ms {reply*1000:>7.1f}ms {done*1000:>7.1f}ms {rejected:>5}")
+
+if __name__ == '__main__':
+    main(*map(float, sys.argv[1:]))
@@ -0,0 +1,139 @@
+import asyncio
+import shutil
+import sys
+import tempfile
+
+from benchmarks import replay
+
+# Run from the repository root:
+#   python -m benchmarks.bench_pollmaker [scenario] [size] [mode]
+#   python -m benchmarks.bench_pollmaker path/to/polls.json [size] [mode]
+#   python -m benchmarks.bench_pollmaker path/to/events.jsonl [size] [mode]
+#   python -m benchmarks.bench_pollmaker record <scenario> <events.jsonl> [size]
+# `size` scales every scenario, `mode` is the poll cache mode ("snapshot",
+# "journal" or "sqlite"). A .json file is cold started from (in sqlite mode
+# that includes migrating it), a .jsonl file is an event stream (see
+# benchmarks/replay.py) replayed against a fresh client.
+# Every scenario runs twice, memory is traced on the second run only so
+# tracemalloc's overhead stays out of the timings.
+
+POLLS = 50
+OPTIONS = 10
+
+def poll_burst(world, size):
+    return [], replay.generate_poll_burst(world, int(500 * size))
+
+def reaction_storm(world, size):
+    polls = max(1, int(POLLS * size))
+    return (
+        replay.generate_poll_burst(world, polls, OPTIONS, OPTIONS),
+        replay.generate_reaction_storm(world, polls, int(20000 * size), OPTIONS)
+    )
+
+def live_storm(world, size):
+    polls = max(1, int(POLLS * size))
+    return (
+        replay.generate_poll_burst(world, polls, OPTIONS, OPTIONS, live=True),
+        replay.generate_reaction_storm(world, polls, int(20000 * size), OPTIONS)
+    )
+
+def votes_burst(world, size):
+    polls = max(1, int(POLLS * size))
+    setup = replay.generate_poll_burst(world, polls, OPTIONS, OPTIONS)
+    setup += replay.generate_reaction_storm(world, polls, int(20000 * size), OPTIONS)
+    return setup, replay.generate_votes_burst(world, polls, int(200 * size))
+
+def export(world, size):
+    polls = max(1, int(POLLS * size))
+    setup = replay.generate_poll_burst(world, polls, OPTIONS, OPTIONS)
+    setup += replay.generate_reaction_storm(world, polls, int(20000 * size), OPTIONS)
+    return setup, replay.generate_export_burst(world, polls, int(50 * size))
+
+def resume(world, size):
+    polls = max(1, int(POLLS * size))
+    setup = replay.generate_poll_burst(world, polls, OPTIONS, OPTIONS)
+    setup += replay.generate_reaction_storm(world, polls, int(20000 * size), OPTIONS)
+    return setup, replay.generate_disconnect(world, polls, int(200 * size), OPTIONS)
+
+SCENARIOS = {
+    "poll_burst": poll_burst,
+    "reaction_storm": reaction_storm,
+    "live_storm": live_storm,
+    "votes_burst": votes_burst,
+    "export": export,
+    "resume": resume,
+}
+
+async def run_events(bench, size, scenario):
+    setup, events = scenario(bench.world, size)
+    await bench.start()
+    await bench.replay(setup)
+    await bench.settle()
+    return await bench.replay(events)
+
+async def run_cold_start(bench, size, filename=None):
+    if filename is None:
+        replay.write_poll_cache_file(bench.world, bench.client.poll_cache_file, int(5000 * size))
+    else:
+        shutil.copyfile(filename, bench.client.poll_cache_file)
+        bench.world.adopt_cache(filename)
+    timing = replay.Timing()
+    timing.elapsed = await bench.start()
+    timing.events = len(bench.client.polls)
+    timing.observe("startup", timing.elapsed)
+    return timing
+
+async def run_event_file(bench, size, filename):
+    await bench.start()
+    return await bench.replay(replay.load_events(filename))
+
+async def measure(run, size, mode, *args):
+    with tempfile.TemporaryDirectory() as directory:
+        bench = replay.Bench(directory, mode=mode)
+        timing = await run(bench, size, *args)
+        await bench.stop()
+        return timing, bench.bytes_written(), dict(bench.client.calls)
+
+def report(name, timing, written, peak, calls):
+    print(f"{name}: {timing.events} events in {timing.elapsed:.2f}s "
+          f"({timing.throughput:,.0f}/s), {timing.errors} errors")
+    for kind, histogram in sorted(timing.latencies.items()):
+        q = histogram.quantiles()
+        print(f"  {kind:<24} n={histogram.count:<7} p50={q[0.5]*1000:>8.2f}ms "
+              f"p95={q[0.95]*1000:>8.2f}ms p99={q[0.99]*1000:>8.2f}ms max={histogram.max*1000:>8.2f}ms")
+    print(f"  written {written:,} bytes, peak traced memory {peak / 2**20:.1f} MiB")
+    print("  API calls: " + (", ".join(f"{method}={n}" for method, n in sorted(calls.items())) or "none"))
+
+def run(name, size, mode):
+    loop = asyncio.get_event_loop()
+    if name.endswith(".json"):
+        args = (run_cold_start, size, mode, name)
+    elif name.endswith(".jsonl"):
+        args = (run_event_file, size, mode, name)
+    elif name == "cold_start":
+        args = (run_cold_start, size, mode)
+    else:
+        args = (run_events, size, mode, SCENARIOS[name])
+    timing, written, calls = loop.run_until_complete(measure(*args))
+    _, peak = loop.run_until_complete(replay.traced(measure)(*args))
+    report(name, timing, written, peak, calls)
+
+def record(name, filename, size=1.0):
+    with tempfile.TemporaryDirectory() as directory:
+        world = replay.Bench(directory).world
+        setup, events = SCENARIOS[name](world, size)
+    replay.save_events(filename, setup + events)
+    print(f"Recorded {len(setup) + len(events)} events to {filename}")
+
+def main(name="all", size="1", mode="snapshot"):
+    if name == "all":
+        for name in ["cold_start"] + list(SCENARIOS):
+            run(name, float(size), mode)
+    else:
+        run(name, float(size), mode)
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ["record"]:
+        record(sys.argv[2], sys.argv[3], *map(float, sys.argv[4:]))
+    else:
+        main(*sys.argv[1:])
@@ -0,0 +1,57 @@
+import random
+import sys
+import time
+
+import tally
+
+# Run from the repository root: python -m benchmarks.bench_tally [voters] [candidates]
+# Times every counting method vectorized against its pure-Python reference
+# on the same ballots and checks they agree. "packed" counts a list of
+# rankings, packing it first, "ballot box" the array a `BallotBox` keeps
+# ready, which is how the bot counts. Voters rank a random number of
+# candidates, weighted by how popular each is, like a real electorate would
+# spread out; popularity is close enough that IRV runs most of its rounds.
+
+def generate_ballots(voters, candidates, seed=0):
+    rng = random.Random(seed)
+    popularity = [rng.uniform(0.5, 1.5) for _ in range(candidates)]
+    ballots = []
+    for _ in range(voters):
+        keys = sorted(range(candidates), key=lambda c: -rng.random() ** (1 / popularity[c]))
+        ballots.append(tuple(keys[:rng.randint(1, candidates)]))
+    return ballots
+
+def best_of(func, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+METHODS = {
+    "irv": (tally.instant_runoff, tally.instant_runoff_reference),
+    "borda": (tally.borda, tally.borda_reference),
+    "approval": (tally.approval, tally.approval_reference),
+}
+
+def main(voters=50000, candidates=10):
+    if tally.numpy is None:
+        print("NumPy isn't installed, there's nothing to compare the references with.")
+        return
+    ballots = generate_ballots(voters, candidates)
+    box = tally.BallotBox(candidates, dict(enumerate(ballots)))
+    print(f"{voters} voters, {candidates} candidates, "
+          f"{sum(map(len, ballots)) / voters:.1f} ranked per ballot")
+    print(f"{'method':<10} {'packed':>10} {'ballot box':>11} {'reference':>11} {'speedup':>8}")
+    for name, (vectorized, reference) in METHODS.items():
+        result, packed_time = best_of(lambda: vectorized(ballots, candidates))
+        boxed, box_time = best_of(lambda: vectorized(box.snapshot(), candidates))
+        expected, reference_time = best_of(lambda: reference(ballots, candidates))
+        assert result == boxed == expected, f"{name} results differ"
+        print(f"{name:<10} {packed_time*1000:>8.1f}ms {box_time*1000:>9.1f}ms "
+              f"{reference_time*1000:>9.1f}ms {reference_time / box_time:>7.1f}x")
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,238 @@
+import asyncio
+import itertools
+import time
+
+import discord
+
+import outbound
+
+# In-process stand-ins for the parts of discord.py the bot talks to.
+# Nothing here touches the network, so runs are repeatable offline.
+# The models subclass the real ones so the cache encoder takes them, their
+# class-level defaults shadow discord.py's read-only properties and slots,
+# which leaves every attribute a plain instance attribute.
+
+_ids = itertools.count(10**17)
+
+def snowflake():
+    return str(next(_ids))
+
+class FakeServer(discord.Server):
+    id = channels = members = me = None
+
+    def __init__(self, server_id=None):
+        self.id = server_id or snowflake()
+        self.channels = {}
+        self.members = {}
+        self.me = None
+
+    def get_channel(self, channel_id):
+        return self.channels.get(channel_id)
+
+    def get_member(self, user_id):
+        return self.members.get(user_id)
+
+class FakeChannel(discord.Channel):
+    id = server = None
+
+    def __init__(self, server, channel_id=None):
+        self.id = channel_id or snowflake()
+        self.server = server
+        server.channels[self.id] = self
+
+class FakeUser(discord.User):
+    id = name = display_name = server = server_permissions = None
+
+    def __init__(self, user_id=None, name=None, server=None):
+        self.id = user_id or snowflake()
+        self.name = self.display_name = name or f"user-{self.id[-6:]}"
+        self.server = server
+        self.server_permissions = FakePermissions()
+
+    def __eq__(self, other):
+        return getattr(other, "id", None) == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __str__(self):
+        return self.name
+
+class FakeMember(FakeUser, discord.Member):
+    # A user as seen from a server, which is what message authors are.
+    pass
+
+class FakePermissions:
+    administrator = False
+
+class FakeReaction:
+    def __init__(self, message, emoji):
+        self.message = message
+        self.emoji = emoji
+        self.users = []
+
+    @property
+    def count(self):
+        return len(self.users)
+
+    @property
+    def me(self):
+        return self.message.server.me in self.users
+
+class FakeMessage(discord.Message):
+    id = channel = server = author = content = reactions = attachments = None
+
+    def __init__(self, channel, author, content, message_id=None):
+        self.id = message_id or snowflake()
+        self.channel = channel
+        self.server = channel.server
+        self.author = author
+        self.content = content
+        self.reactions = []
+        self.attachments = []
+
+    def reaction(self, emoji):
+        for reaction in self.reactions:
+            if reaction.emoji == emoji:
+                return reaction
+        reaction = FakeReaction(self, emoji)
+        self.reactions.append(reaction)
+        return reaction
+
+class FakeResponse:
+    def __init__(self, status, reason=""):
+        self.status = status
+        self.reason = reason
+
+class FakeHTTPException(Exception):
+    def __init__(self, status, text=""):
+        super().__init__(f"{status} {text}")
+        self.response = FakeResponse(status)
+
+def not_found(text):
+    return discord.errors.NotFound(FakeResponse(404, "Not Found"), text)
+
+class FakeRateLimits:
+    # Enforces per-route buckets the way Discord does: requests beyond the
+    # limit get a 429, every response reports the bucket's state (standing
+    # in for the X-RateLimit-Remaining/Reset-After headers).
+    def __init__(self, limits, scale=1.0):
+        self.limits = {
+            method: (limit, per * scale) for method, (limit, per) in limits.items()
+        }
+        self.scale = scale
+        self.buckets = {}
+        self.listeners = []
+        self.rejected = 0
+
+    def hit(self, route):
+        limit, per = self.limits.get(route[0], outbound.DEFAULT_ROUTE_LIMIT)
+        now = time.monotonic()
+        remaining, reset_at = self.buckets.get(route, (limit, now + per))
+        if now >= reset_at:
+            remaining, reset_at = limit, now + per
+        if remaining == 0:
+            self.rejected += 1
+            raise FakeHTTPException(429, "You are being rate limited.")
+        self.buckets[route] = (remaining - 1, reset_at)
+        for listener in self.listeners:
+            listener(route, remaining - 1, reset_at - now)
+
+class FakeDiscordClient:
+    # Mirrors the discord.Client coroutine methods used by HelixClient and
+    # the modules, backed by plain in-memory objects. It passes any other
+    # keyword arguments on, so it can be mixed in over a real client class.
+    def __init__(self, *args, latency=0.0, rate_limits=None, **kwargs):
+        self.latency = latency
+        self.rate_limits = rate_limits
+        self.calls = {}
+        self.known_servers = {}
+        self.known_users = {}
+        self.stored_messages = {}
+        self.logged_out = False
+        super().__init__(*args, **kwargs)
+
+    def add_server(self, server):
+        self.known_servers[server.id] = server
+        for member in server.members.values():
+            self.known_users[member.id] = member
+        return server
+
+    def add_user(self, user):
+        self.known_users[user.id] = user
+        if user.server is not None:
+            user.server.members[user.id] = user
+        return user
+
+    async def _request(self, method, target):
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if self.rate_limits is not None and target is not None:
+            self.rate_limits.hit(outbound.route_key(method, target))
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def get_server(self, server_id):
+        return self.known_servers.get(server_id)
+
+    async def send_message(self, channel, content):
+        await self._request("send_message", channel)
+        message = FakeMessage(channel, channel.server.me, content)
+        self.stored_messages[message.id] = message
+        return message
+
+    async def send_file(self, channel, fp, filename=None, content=None):
+        # Reads the upload like the real one would, only its size is kept.
+        await self._request("send_file", channel)
+        size = 0
+        for block in iter(lambda: fp.read(65536), b""):
+            size += len(block)
+        message = FakeMessage(channel, channel.server.me, content)
+        message.attachments = [{"filename": filename, "size": size}]
+        self.stored_messages[message.id] = message
+        return message
+
+    async def edit_message(self, message, content):
+        await self._request("edit_message", message)
+        message.content = content
+        return message
+
+    async def add_reaction(self, message, emoji):
+        await self._request("add_reaction", message)
+        reaction = message.reaction(emoji)
+        if message.server.me not in reaction.users:
+            reaction.users.append(message.server.me)
+
+    async def get_message(self, channel, message_id):
+        await self._request("get_message", channel)
+        try:
+            return self.stored_messages[message_id]
+        except KeyError:
+            raise not_found("Unknown Message") from None
+
+    async def get_user_info(self, user_id):
+        await self._request("get_user_info", None)
+        try:
+            return self.known_users[user_id]
+        except KeyError:
+            raise not_found("Unknown User") from None
+
+    async def get_reaction_users(self, reaction, limit=100, after=None):
+        await self._request("get_reaction_users", reaction.message)
+        users = reaction.users
+        start = users.index(after) + 1 if after is not None else 0
+        return users[start:start+limit]
+
+    async def logout(self):
+        self.logged_out = True
+
+async def call_with_retries(client, method, *args):
+    # What a client without outbound pacing ends up doing: fire, eat the
+    # 429, wait out the bucket, try again.
+    while True:
+        try:
+            return await getattr(client, method)(*args)
+        except FakeHTTPException as e:
+            if e.response.status != 429:
+                raise
+            limits = client.rate_limits
+            await asyncio.sleep(limits.limits.get(method, outbound.DEFAULT_ROUTE_LIMIT)[1])
@@ -0,0 +1,368 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+import tracemalloc
+
+import caching
+import main
+import metrics
+import outbound
+import storage
+import modules.pollmaker as pollmaker
+from benchmarks import fakes
+
+logger = logging.getLogger(__name__)
+
+# Drives a real HelixClient with generated or recorded event streams.
+# Events are plain dicts, so a stream can be saved as JSON Lines:
+#   {"type": "message", "channel": 0, "user": 12, "content": "&votes 3"}
+#   {"type": "reaction_add", "poll": 3, "emoji": "1⃣", "user": 12}
+#   {"type": "reaction_remove", "poll": null, "emoji": "👍", "user": 12}
+#   {"type": "message_delete", "poll": 3}
+#   {"type": "resume"}
+# Channels and users are indices into the World, polls are indices into
+# client.polls; a reaction on "poll": null lands on ordinary chatter.
+# Reaction types prefixed with "offline_" only change the message, as if
+# the bot had been disconnected, "resume" then reconnects it.
+
+class BenchHelixClient(fakes.FakeDiscordClient, main.HelixClient):
+    # `rate_limit_scale` shrinks the outbound scheduler's buckets, at 0 it
+    # never waits, so only the bot's own work gets measured.
+    def __init__(self, *args, rate_limit_scale=0.0, **kwargs):
+        self.rate_limit_scale = rate_limit_scale
+        super().__init__(*args, **kwargs)
+
+    def create_outbound_scheduler(self):
+        scale = self.rate_limit_scale
+        return outbound.OutboundScheduler(self, {
+            method: (limit, per * scale) for method, (limit, per) in outbound.ROUTE_LIMITS.items()
+        }, global_limit=(outbound.GLOBAL_LIMIT[0], outbound.GLOBAL_LIMIT[1] * scale))
+
+class World:
+    # The servers, channels and users events refer to. Lookups by ID create
+    # whatever is missing, so a foreign cache file can be adopted as is.
+    def __init__(self, client, channels=4, users=1000, members=0.5, seed=0):
+        self.client = client
+        self.random = random.Random(seed)
+        self.server = self.get_server(None)
+        self.channels = [fakes.FakeChannel(self.server) for _ in range(channels)]
+        self.users = [
+            self.get_user(None, self.server if self.random.random() < members else None)
+            for _ in range(users)
+        ]
+        self.chatter = [
+            fakes.FakeMessage(channel, self.users[0], "just chatting")
+            for channel in self.channels
+        ]
+        for message in self.chatter:
+            client.messages.append(message)
+
+    def get_server(self, server_id):
+        server = self.client.get_server(server_id)
+        if server is None:
+            server = fakes.FakeServer(server_id)
+            server.me = fakes.FakeMember(name="helix", server=server)
+            server.members[server.me.id] = server.me
+            self.client.add_server(server)
+        return server
+
+    def get_channel(self, server, channel_id):
+        return server.get_channel(channel_id) or fakes.FakeChannel(server, channel_id)
+
+    def get_user(self, user_id, server=None):
+        user = self.client.known_users.get(user_id)
+        if user is None:
+            kind = fakes.FakeUser if server is None else fakes.FakeMember
+            user = self.client.add_user(kind(user_id, server=server))
+        return user
+
+    def get_message(self, channel, message_id, content="", author=None):
+        message = self.client.stored_messages.get(message_id)
+        if message is None:
+            message = fakes.FakeMessage(channel, author or channel.server.me, content, message_id)
+            self.client.stored_messages[message.id] = message
+        return message
+
+    def adopt(self, reference):
+        kind = reference["type"]
+        if kind == "Server":
+            return self.get_server(reference["id"])
+        elif kind == "Channel":
+            return self.get_channel(self.adopt(reference["server"]), reference["id"])
+        elif kind == "Message":
+            return self.get_message(self.adopt(reference["channel"]), reference["id"])
+        elif kind == "Member":
+            return self.get_user(reference["id"], self.adopt(reference["server"]))
+        return self.get_user(reference["id"])
+
+    def adopt_cache(self, filename):
+        # Makes every object a poll cache refers to exist, so that loading
+        # it hydrates without 404s.
+        with open(filename, encoding="utf-8") as file:
+            polls = storage.decode_poll_snapshot(file.read())[1]
+        for poll in polls:
+            for key in ("author", "poll_message", "owner"):
+                if caching.is_cached_reference(poll[key]):
+                    self.adopt(poll[key])
+            for voters in poll["votes"]:
+                for voter in voters:
+                    if caching.is_cached_reference(voter):
+                        self.adopt(voter)
+                    elif voter is not None:
+                        self.get_user(voter)
+        return len(polls)
+
+    def poll_message(self, poll_index):
+        polls = self.client.polls
+        if poll_index is not None and poll_index < len(polls) and not polls[poll_index].dead:
+            message = polls[poll_index].poll_message
+            if not caching.is_cached_reference(message):
+                return message
+            return self.client.stored_messages.get(caching.cached_id(message))
+        return None
+
+    async def dispatch(self, event):
+        kind = event["type"]
+        client = self.client
+        handled = None
+        if kind == "message":
+            user = self.users[event["user"]]
+            channel = self.channels[event["channel"]]
+            handled = await client.on_message(fakes.FakeMessage(channel, user, event["content"]))
+        elif kind.endswith(("reaction_add", "reaction_remove")):
+            user = self.users[event["user"]]
+            message = self.poll_message(event["poll"])
+            if message is None:
+                message = self.chatter[event["user"] % len(self.chatter)]
+            reaction = message.reaction(event["emoji"])
+            if kind.endswith("reaction_add"):
+                if user not in reaction.users:
+                    reaction.users.append(user)
+                if kind == "reaction_add":
+                    handled = await client.on_reaction_add(reaction, user)
+            else:
+                if user in reaction.users:
+                    reaction.users.remove(user)
+                if kind == "reaction_remove":
+                    handled = await client.on_reaction_remove(reaction, user)
+        elif kind == "message_delete":
+            message = self.poll_message(event["poll"])
+            if message is not None:
+                handled = await client.on_message_delete(message)
+        elif kind == "resume":
+            # Counted until the reconciliation it starts is done.
+            await client.on_resumed()
+            if client.poll_reconciliation is not None:
+                await client.poll_reconciliation
+        else:
+            raise ValueError(f"Unknown event type {kind}")
+        # Counted until the client's workers are done with it, not just
+        # until it has been queued.
+        if handled is not None:
+            await handled
+
+def poll_command(options, title=None, live=False):
+    args = [json.dumps(option) for option in options]
+    kwargs = []
+    if title is not None:
+        kwargs.append(f'"title": {json.dumps(title)}')
+    if live:
+        kwargs.append('"live": True')
+    if kwargs:
+        args.append("{" + ", ".join(kwargs) + "}")
+    return "&addpoll(" + ", ".join(args) + ")"
+
+def generate_poll_burst(world, polls, min_options=2, max_options=10, live=False):
+    rng = world.random
+    return [{
+        "type": "message",
+        "channel": rng.randrange(len(world.channels)),
+        "user": rng.randrange(len(world.users)),
+        "content": poll_command(
+            [f"Option {i}" for i in range(rng.randint(min_options, max_options))],
+            title=f"Poll {n}", live=live
+        )
+    } for n in range(polls)]
+
+def generate_reaction_storm(world, polls, events, options=10, remove_ratio=0.15, noise_ratio=0.05):
+    # Votes on the first `polls` polls, which should have `options` options
+    # each. Removals take back an earlier vote, noise hits other messages
+    # or uses emojis that aren't options.
+    rng = world.random
+    cast = []
+    stream = []
+    for _ in range(events):
+        roll = rng.random()
+        if roll < noise_ratio:
+            stream.append({
+                "type": "reaction_add", "poll": rng.choice([None, rng.randrange(polls)]),
+                "emoji": "👍", "user": rng.randrange(len(world.users))
+            })
+        elif roll < noise_ratio + remove_ratio and cast:
+            vote = cast.pop(rng.randrange(len(cast)))
+            stream.append(dict(vote, type="reaction_remove"))
+        else:
+            vote = {
+                "type": "reaction_add", "poll": rng.randrange(polls),
+                "emoji": pollmaker.UNICODE_EMOJI_NUMBERS[rng.randint(1, options)],
+                "user": rng.randrange(len(world.users))
+            }
+            cast.append(vote)
+            stream.append(vote)
+    return stream
+
+def generate_disconnect(world, polls, events, options=10):
+    # A reaction storm the bot misses, followed by the resume.
+    missed = generate_reaction_storm(world, polls, events, options, noise_ratio=0.0)
+    return [dict(event, type="offline_" + event["type"]) for event in missed] + [{"type": "resume"}]
+
+def generate_votes_burst(world, polls, commands):
+    rng = world.random
+    return [{
+        "type": "message",
+        "channel": rng.randrange(len(world.channels)),
+        "user": rng.randrange(len(world.users)),
+        "content": f"&votes {rng.randrange(polls) + 1}"
+    } for _ in range(commands)]
+
+def generate_export_burst(world, polls, commands, export_format="csv"):
+    rng = world.random
+    return [{
+        "type": "message",
+        "channel": rng.randrange(len(world.channels)),
+        "user": rng.randrange(len(world.users)),
+        "content": f"&exportpoll {rng.randrange(polls) + 1} {export_format}"
+    } for _ in range(commands)]
+
+def generate_poll_caches(world, polls, active_ratio=0.2, voters=50, options=10):
+    # Poll caches as PollModel.create_cache makes them, for polls whose
+    # messages exist in the world, without creating them one by one.
+    rng = world.random
+    dlist = []
+    for poll_index in range(polls):
+        channel = rng.choice(world.channels)
+        text = pollmaker.create_poll_template_text([f"Option {i}" for i in range(options)], poll_index + 1)
+        message = world.get_message(channel, None, text)
+        poll = pollmaker.PollModel(
+            poll_index, rng.choice(world.users), message,
+            [f"Option {i}" for i in range(options)], world.server.me
+        )
+        for user in rng.sample(world.users, min(voters, len(world.users))):
+            option = rng.randrange(options)
+            poll.insert_vote(option, user.id)
+            message.reaction(pollmaker.UNICODE_EMOJI_NUMBERS[option + 1]).users.append(user)
+        poll.active = rng.random() < active_ratio
+        if not poll.active:
+            # Ended at some point in the last month.
+            poll.last_activity -= rng.uniform(0, 30 * 24 * 3600)
+        dlist.append(poll.create_cache())
+    return dlist
+
+def write_poll_cache_file(world, filename, polls, **options):
+    data = storage.encode_poll_snapshot(0, generate_poll_caches(world, polls, **options))
+    caching.atomic_write(filename, data)
+    return len(data.encode("utf-8"))
+
+def save_events(filename, events):
+    with open(filename, "w", encoding="utf-8") as file:
+        for event in events:
+            file.write(json.dumps(event, ensure_ascii=False) + "\n")
+
+def load_events(filename):
+    with open(filename, encoding="utf-8") as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+class Timing:
+    def __init__(self):
+        self.events = 0
+        self.errors = 0
+        self.elapsed = 0.0
+        self.latencies = {}
+
+    def observe(self, kind, seconds):
+        if kind not in self.latencies:
+            self.latencies[kind] = metrics.Histogram(reservoir_size=None)
+        self.latencies[kind].observe(seconds)
+
+    @property
+    def throughput(self):
+        return self.events / self.elapsed if self.elapsed else 0.0
+
+class Bench:
+    # One client in a scratch directory. Every event is dispatched as its
+    # own task like discord.py's gateway does, its latency runs from
+    # dispatch until its handlers are done.
+    def __init__(self, directory, mode="snapshot", world_options={}, **client_options):
+        self.directory = directory
+        self.client = BenchHelixClient(
+            poll_cache_file=os.path.join(directory, "polls.json"),
+            poll_database_file=os.path.join(directory, "polls.db"),
+            poll_cache_mode=mode, **client_options
+        )
+        self.world = World(self.client, **world_options)
+
+    async def start(self):
+        start = time.perf_counter()
+        await self.client.on_ready()
+        await self.settle()
+        return time.perf_counter() - start
+
+    async def settle(self):
+        if self.client.poll_hydration is not None:
+            await self.client.poll_hydration
+        if self.client.poll_reconciliation is not None:
+            await self.client.poll_reconciliation
+        await self.client.events.drain()
+        await self.client.outbound.drain()
+
+    async def replay(self, events, rate=None, timing=None):
+        timing = timing or Timing()
+        async def run(event, dispatched):
+            try:
+                await self.world.dispatch(event)
+            except Exception:
+                timing.errors += 1
+                logger.exception("Event %r failed", event)
+            timing.observe(event["type"], time.perf_counter() - dispatched)
+        start = time.perf_counter()
+        tasks = []
+        for n, event in enumerate(events):
+            if rate is not None:
+                await asyncio.sleep(max(0.0, start + n / rate - time.perf_counter()))
+            tasks.append(asyncio.ensure_future(run(event, time.perf_counter())))
+            # The gateway hands over control between events too.
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        timing.elapsed += time.perf_counter() - start
+        timing.events += len(events)
+        return timing
+
+    async def stop(self):
+        await self.settle()
+        await self.client.finalize_and_logout()
+
+    def bytes_written(self):
+        # For SQLite that's the size of the database it leaves behind.
+        poll_storage = self.client.poll_storage
+        if isinstance(poll_storage, storage.SQLitePollStorage):
+            return sum(
+                os.path.getsize(poll_storage.filename + suffix)
+                for suffix in ("", "-wal") if os.path.exists(poll_storage.filename + suffix)
+            )
+        written = self.client.metrics.counters.get("poll_cache_write_bytes", 0)
+        return written + poll_storage.vote_journal.bytes_written
+
+def traced(coro_function):
+    # Runs the coroutine function with tracemalloc on, returns its result
+    # and the peak traced memory in bytes.
+    async def wrapper(*args, **kwargs):
+        tracemalloc.start()
+        try:
+            result = await coro_function(*args, **kwargs)
+            return result, tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return wrapper
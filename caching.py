@@ -1,8 +1,15 @@
 import asyncio
 import json
+import logging
+import os
+import tempfile
+import time
+from collections import OrderedDict
 
 import discord
 
+logger = logging.getLogger(__name__)
+
 SUPPORTED_DISCORD_TYPES = (
     discord.Server, discord.Channel, discord.Message, 
     discord.Member, discord.User
@@ -42,26 +49,174 @@ def cache_discord_object(obj):
         }
 
 def recover_discord_object(client, cache):
+    # Anything in a server the bot left, or in a deleted channel, is gone
+    # too and recovers as None.
     if cache["type"] == "Server":
         return client.get_server(cache["id"])
     elif cache["type"] == "Channel":
-        return cache["server"].get_channel(cache["id"])
+        return recover_child(cache["server"], "get_channel", cache["id"])
     elif cache["type"] == "Message":
         return client.get_message(cache["channel"], cache["id"])
     elif cache["type"] == "Member":
-        return cache["server"].get_member(cache["id"])
+        return recover_child(cache["server"], "get_member", cache["id"])
     elif cache["type"] == "User":
-        return client.get_user_info(cache["id"])
+        return client.get_cached_user_info(cache["id"])
     else:
         raise ValueError("Unknown discord type.")
 
+def recover_child(parent, getter, child_id):
+    if parent is None:
+        return None
+    return getattr(parent, getter)(child_id)
+
+class PendingLookup:
+    # A Discord object that needs an API call to recover. The decoder hands
+    # out one of these per distinct object, `await_all` resolves them.
+    __slots__ = ("key", "factory")
+
+    def __init__(self, key, factory):
+        self.key = key
+        self.factory = factory
+
+    def __repr__(self):
+        return f"<PendingLookup {self.key}>"
+
+def lookup_key(cache):
+    if cache["type"] == "Message":
+        return ("Message", cache["channel"].id, cache["id"])
+    return (cache["type"], cache["id"])
+
 def discord_support_decoder_hook_factory(client):
+    lookups = {}
     def discord_support_decoder_hook(dct):
         if "type" in dct and dct["type"] in SUPPORTED_DISCORD_TYPES_STR:
-            return recover_discord_object(client, dct)
+            if dct["type"] not in ("Message", "User"):
+                return recover_discord_object(client, dct)
+            if dct["type"] == "Message" and dct["channel"] is None:
+                return None
+            key = lookup_key(dct)
+            if key not in lookups:
+                lookups[key] = PendingLookup(
+                    key, lambda: recover_discord_object(client, dct)
+                )
+            return lookups[key]
         return dct
     return discord_support_decoder_hook
 
+def apply_decoder_hook(cache, hook):
+    # Same as decoding with `object_hook`, for structures that were
+    # loaded as plain JSON and are only recovered later.
+    if isinstance(cache, dict):
+        return hook({key: apply_decoder_hook(value, hook) for key, value in cache.items()})
+    elif isinstance(cache, list):
+        return [apply_decoder_hook(value, hook) for value in cache]
+    return cache
+
+SCALAR_TYPES = {str, int, float, bool, type(None)}
+
+class ReferenceTable:
+    # Interns references to Servers, Channels, Members and Users: each one
+    # is kept once in `objects` and replaced by {"$ref": key} everywhere,
+    # its own server included. Messages are unique, they stay inline.
+    INTERNED_TYPES = ("Server", "Channel", "Member", "User")
+
+    def __init__(self):
+        self.objects = {}
+        self.keys = {}
+        # Live Discord objects come up again and again (the bot owns every
+        # poll), those are only converted the first time.
+        self.seen = {}
+
+    def intern(self, value):
+        if isinstance(value, SUPPORTED_DISCORD_TYPES):
+            if id(value) not in self.seen:
+                self.seen[id(value)] = (value, self.intern(cache_discord_object(value)))
+            return self.seen[id(value)][1]
+        if isinstance(value, list):
+            # Mostly long lists of voter IDs, those are passed on as they are.
+            if set(map(type, value)) <= SCALAR_TYPES:
+                return value
+            return [item if type(item) in SCALAR_TYPES else self.intern(item) for item in value]
+        elif not isinstance(value, dict):
+            return value
+        value = {
+            key: item if type(item) in SCALAR_TYPES else self.intern(item)
+            for key, item in value.items()
+        }
+        if value.get("type") not in self.INTERNED_TYPES:
+            return value
+        server = value.get("server")
+        identity = (value["type"], value["id"], server and server["$ref"])
+        key = self.keys.get(identity)
+        if key is None:
+            key = self.keys[identity] = str(len(self.keys))
+            self.objects[key] = value
+        return {"$ref": key}
+
+class ReferenceTableDecoder:
+    # The `object_hook` undoing `ReferenceTable.intern`. Every reference to
+    # a key decodes to the same dict, which `resolve` fills in once the
+    # table has been read, so each object is built once and shared.
+    def __init__(self):
+        self.references = {}
+
+    def __call__(self, dct):
+        if len(dct) == 1 and "$ref" in dct:
+            return self.references.setdefault(dct["$ref"], {})
+        return dct
+
+    def resolve(self, objects):
+        for key, reference in self.references.items():
+            reference.update(objects[key])
+
+def is_cached_reference(obj):
+    return isinstance(obj, dict) and obj.get("type") in SUPPORTED_DISCORD_TYPES_STR
+
+def cached_id(obj):
+    # Works for Discord objects, cache references that weren't resolved
+    # yet and bare IDs (older caches hold whole users as voters).
+    if obj is None or isinstance(obj, str):
+        return obj
+    elif isinstance(obj, dict):
+        return obj["id"]
+    return obj.id
+
+async def resolve_cached_object(client, cache):
+    hook = discord_support_decoder_hook_factory(client)
+    holder = [apply_decoder_hook(cache, hook)]
+    await await_all([holder], report=False)
+    return holder[0]
+
+class LRUCache:
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+        self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def get(self, key, default=None):
+        try:
+            self.items.move_to_end(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return self.items[key]
+
+    def put(self, key, value):
+        self.items[key] = value
+        self.items.move_to_end(key)
+        while len(self.items) > self.maxsize:
+            self.items.popitem(last=False)
+
+    def pop(self, key, default=None):
+        return self.items.pop(key, default)
+
 class DiscordSupportJSONEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, SUPPORTED_DISCORD_TYPES):
@@ -69,18 +224,133 @@ class DiscordSupportJSONEncoder(json.JSONEncoder):
         else:
             return super().default(obj)
 
-async def await_all(cache):
+async def resolve_lookup(lookup, semaphore):
+    async with semaphore:
+        try:
+            if asyncio.iscoroutine(lookup):
+                return await lookup
+            return await lookup.factory()
+        except discord.errors.NotFound:
+            logger.warning("Couldn't await %r (error 404), using temporary None", lookup)
+            return None
+
+async def await_all(cache, concurrency=16, report=True):
+    start = time.monotonic()
+    # Walk the whole structure first, so every distinct object is fetched
+    # once no matter how many places refer to it.
+    references = []
     for sub in cache:
         stack = [sub]
         while stack:
             current = stack.pop()
             it = current.items() if isinstance(current, dict) else enumerate(current)
             for key, value in it:
-                if asyncio.iscoroutine(value):
-                    try:
-                        current[key] = await value 
-                    except discord.errors.NotFound:
-                        print(f"Couldn't await '{value}' (error 404), using temporary None")
-                        current[key] = None
+                if isinstance(value, PendingLookup) or asyncio.iscoroutine(value):
+                    references.append((current, key, value))
                 elif isinstance(value, (dict, list)):
                     stack.append(value)
+    pending = list({id(value): value for _, _, value in references}.values())
+    if not pending:
+        return
+    if report:
+        logger.info("Hydrating %d Discord objects (%d references)", len(pending), len(references))
+    semaphore = asyncio.Semaphore(concurrency)
+    resolved = {}
+    report_every = max(1, len(pending) // 10)
+    tasks = [asyncio.ensure_future(resolve_lookup(value, semaphore)) for value in pending]
+    try:
+        for done, (value, task) in enumerate(zip(pending, tasks), 1):
+            resolved[id(value)] = await task
+            if report and (done % report_every == 0 or done == len(pending)):
+                logger.info("Hydrated %d/%d Discord objects", done, len(pending))
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+    for current, key, value in references:
+        current[key] = resolved[id(value)]
+    if report:
+        logger.info("Hydration took %.2fs", time.monotonic() - start)
+
+def atomic_write(filename, data, encoding="utf-8"):
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, temp_filename = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "w", encoding=encoding) as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_filename, filename)
+    except BaseException:
+        try:
+            os.remove(temp_filename)
+        except OSError:
+            pass
+        raise
+
+class CoalescingFlusher:
+    # `prepare` runs on the event loop and should return a snapshot of the
+    # state to persist (or None to skip), `write` then gets that snapshot
+    # in an executor, so the loop never waits on serialization or disk.
+    def __init__(self, prepare, write, interval=5.0, threshold=100):
+        self.prepare = prepare
+        self.write = write
+        self.interval = interval
+        self.threshold = threshold
+        self.pending = 0
+        self.requests = 0
+        self.flushes = 0
+        self.coalesced = 0
+        self.closed = False
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task = None
+
+    def mark_dirty(self):
+        self.pending += 1
+        self.requests += 1
+        if self.pending >= self.threshold:
+            self._wakeup.set()
+        if not self.closed and (self._task is None or self._task.done()):
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        while self.pending and not self.closed:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                if not await self.flush():
+                    # `prepare` skipped it, the next change tries again.
+                    return
+            except Exception:
+                logger.exception("Background cache flush failed")
+
+    async def flush(self):
+        async with self._lock:
+            if not self.pending:
+                return False
+            pending, self.pending = self.pending, 0
+            try:
+                snapshot = self.prepare()
+                if snapshot is None:
+                    # Still outstanding, nothing was written.
+                    self.pending += pending
+                    return False
+                loop = asyncio.get_event_loop()
+                await loop.run_in_executor(None, self.write, snapshot)
+            except BaseException:
+                self.pending += pending
+                raise
+            self.flushes += 1
+            self.coalesced += pending - 1
+            return True
+
+    async def close(self):
+        self.closed = True
+        if self._task is not None and not self._task.done():
+            self._wakeup.set()
+            await self._task
+        return await self.flush()
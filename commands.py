@@ -1,26 +1,69 @@
-import ast
 import asyncio
+import logging
+
+import arguments
+
+logger = logging.getLogger(__name__)
+
+# Marks the node where a command name ends in the trie. Thanks to the
+# no-prefixes rule such a node never has any children.
+TERMINAL = None
 
 class CommandHandler:
-    def __init__(self, prefix):
+    def __init__(self, prefix, metrics=None):
         self.prefix = prefix
+        self.metrics = metrics
         self.commands = {}
         self.groups = {}
+        self.trie = {}
 
     def is_valid_command_name(self, name):
-        for pre in self.commands:
-            if pre.startswith(name) or name.startswith(pre):
+        if not name or any(c.isspace() for c in name):
+            return False
+        node = self.trie
+        for c in name:
+            if TERMINAL in node:
                 return False
-        else:
-            return True
+            if c not in node:
+                return True
+            node = node[c]
+        # Either the name exists already or it's a prefix of another one.
+        return False
 
     def add_command(self, name, func):
         assert self.is_valid_command_name(name), \
                f"{name} doesn't satisfy no-prefixes rule"
         self.commands[name] = func
+        node = self.trie
+        for c in name:
+            node = node.setdefault(c, {})
+        node[TERMINAL] = name
 
     def remove_command(self, name):
         del self.commands[name]
+        path = []
+        node = self.trie
+        for c in name:
+            path.append((node, c))
+            node = node[c]
+        del node[TERMINAL]
+        # Prune the branch up to the first node other commands still use.
+        for parent, c in reversed(path):
+            if parent[c]:
+                break
+            del parent[c]
+
+    def match_command(self, string):
+        if not string.startswith(self.prefix):
+            return None
+        node = self.trie
+        for i in range(len(self.prefix), len(string)):
+            node = node.get(string[i])
+            if node is None:
+                return None
+            if TERMINAL in node:
+                return node[TERMINAL]
+        return None
 
     def add_command_group(self, group, commands):
         assert all(self.is_valid_command_name(name) 
@@ -37,30 +80,17 @@ class CommandHandler:
 
     @staticmethod
     def command_find_args(instr):
-        left = instr.find('(')
-        right = instr.rfind(')')
-        # The comma at the end raises a SyntaxError for empty tuples,
-        # but it allows 1-element tuples: `(spam,)` 
-        # and is ignored for larger tuples: `(foo, bar,)`.
-        if right - left > 1:
-            back = ",)"
-        elif ")" in instr:
-            back = ")"
-        else:
-            back = ""
-        string = instr[left:right] + back
-        args = ast.literal_eval(string)
-        if args and isinstance(args[-1], dict):
-            kwargs = args[-1]
-            args = args[:-1]
-        else:
-            kwargs = {}
-        return args, kwargs
+        return arguments.parse_call_arguments(instr)
 
     async def handle_command_call(self, string, *args, **kwargs):
         if not string: return
-        body = string.split()[0]
-        for name, func in self.commands.items():
-            if body.startswith(self.prefix + name):
-                status = await func(*args, **kwargs)
-                print(f"Executed {name}, got status: '{status}'")
+        if string[0].isspace():
+            string = string.lstrip()
+        name = self.match_command(string)
+        if name is not None:
+            call = self.commands[name](*args, **kwargs)
+            if self.metrics is not None:
+                status = await self.metrics.timed(f"command.{name}", call)
+            else:
+                status = await call
+            logger.info("Executed %s, got status: '%s'", name, status, extra={"event": "command"})
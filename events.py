@@ -0,0 +1,171 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_PENDING_EVENTS = 10000
+DEFAULT_MAX_QUEUED_EVENTS = 1000
+DEFAULT_DEADLINE_COALESCE = 1.0
+
+def current_task():
+    # asyncio.current_task only exists from Python 3.7 on.
+    if hasattr(asyncio, "current_task"):
+        return asyncio.current_task()
+    return asyncio.Task.current_task()
+
+class ReactionInterest:
+    # What a reaction listener cares about. Both are containers checked
+    # with `in` (a live dict works, so the interest follows its updates),
+    # None means anything goes.
+    __slots__ = ("message_ids", "emojis")
+
+    def __init__(self, message_ids=None, emojis=None):
+        self.message_ids = message_ids
+        self.emojis = emojis
+
+    def matches(self, reaction):
+        if self.message_ids is not None and reaction.message.id not in self.message_ids:
+            return False
+        return self.emojis is None or reaction.emoji in self.emojis
+
+class EventDispatcher:
+    # Hands gateway events to one worker per key, so everything for the
+    # same key (a poll's message, say) is handled in arrival order
+    # while other keys carry on in parallel. Once too many events are
+    # waiting, overall or for one key, `submit` holds its caller until the
+    # workers catch up.
+    def __init__(self, max_pending=DEFAULT_MAX_PENDING_EVENTS,
+                 max_queued=DEFAULT_MAX_QUEUED_EVENTS, metrics=None):
+        self.max_pending = max_pending
+        self.max_queued = max_queued
+        self.metrics = metrics
+        self.queues = {}
+        self.workers = {}
+        self.pending = 0
+        self.dropped = 0
+        self.closed = False
+        self.progress = asyncio.Event()
+        if metrics is not None:
+            metrics.gauge("events_pending", lambda: self.pending)
+            metrics.gauge("events_queues", lambda: len(self.queues))
+            metrics.gauge("events_dropped", lambda: self.dropped)
+
+    async def submit(self, key, name, coro_function, *args):
+        # Returns a future for when the event has been handled.
+        future = asyncio.get_event_loop().create_future()
+        if self.closed:
+            self.dropped += 1
+            future.set_result(None)
+            return future
+        future.add_done_callback(self._report_failure)
+        queue = self.queues.setdefault(key, deque())
+        queue.append((name, coro_function, args, future, time.monotonic()))
+        self.pending += 1
+        if key not in self.workers:
+            self.workers[key] = asyncio.ensure_future(self._serve(key))
+        if self.pending > self.max_pending or len(queue) > self.max_queued:
+            if self.metrics is not None:
+                self.metrics.count("events_backpressured")
+            while self.pending > self.max_pending or len(queue) > self.max_queued:
+                await self.progress.wait()
+        return future
+
+    @staticmethod
+    def _report_failure(future):
+        if not future.cancelled() and future.exception() is not None:
+            e = future.exception()
+            logger.error("Event handler failed: %r", e, exc_info=(type(e), e, e.__traceback__))
+
+    async def _serve(self, key):
+        queue = self.queues[key]
+        try:
+            while queue:
+                name, coro_function, args, future, queued_at = queue.popleft()
+                if self.metrics is not None:
+                    self.metrics.histogram("event_queue_wait").observe(time.monotonic() - queued_at)
+                try:
+                    await coro_function(*args)
+                except Exception as e:
+                    if self.metrics is not None:
+                        self.metrics.count(f"events_failed.{name}")
+                    if not future.cancelled():
+                        future.set_exception(e)
+                else:
+                    if not future.cancelled():
+                        future.set_result(None)
+                finally:
+                    self.pending -= 1
+                    # Wakes everyone held back by `submit` to check again.
+                    self.progress.set()
+                    self.progress = asyncio.Event()
+        finally:
+            del self.workers[key]
+            if not queue:
+                del self.queues[key]
+
+    async def drain(self):
+        # Handlers may drain too (`&leave` closes the dispatcher), their
+        # own worker can't be waited for.
+        current = current_task()
+        while True:
+            workers = [worker for worker in self.workers.values() if worker is not current]
+            if not workers:
+                return
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    async def close(self):
+        # Whatever is already queued still gets handled, later events don't.
+        self.closed = True
+        await self.drain()
+
+class DeadlineScheduler:
+    # One task for any number of deadlines (in seconds since the epoch, so
+    # they mean the same after a restart). It sleeps until the earliest one
+    # plus `coalesce`, then hands everything due by then to `expire` as a
+    # single batch. Entries are never taken back, `expire` has to check
+    # whether each item still applies.
+    def __init__(self, expire, coalesce=DEFAULT_DEADLINE_COALESCE):
+        self.expire = expire
+        self.coalesce = coalesce
+        self.heap = []
+        self.counter = itertools.count()
+        self.wakeup = asyncio.Event()
+        self.task = None
+
+    def schedule(self, deadline, item):
+        heapq.heappush(self.heap, (deadline, next(self.counter), item))
+        if self.task is None:
+            self.task = asyncio.ensure_future(self._run())
+        elif self.heap[0][2] is item:
+            self.wakeup.set()
+
+    async def _run(self):
+        try:
+            while self.heap:
+                delay = self.heap[0][0] + self.coalesce - time.time()
+                if delay > 0:
+                    self.wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self.wakeup.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                now = time.time()
+                batch = []
+                while self.heap and self.heap[0][0] <= now:
+                    batch.append(heapq.heappop(self.heap)[2])
+                try:
+                    await self.expire(batch)
+                except Exception:
+                    logger.exception("Couldn't expire %d deadlines", len(batch))
+        finally:
+            self.task = None
+
+    def close(self):
+        if self.task is not None:
+            self.task.cancel()
+        self.heap.clear()
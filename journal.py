@@ -0,0 +1,111 @@
+import json
+import logging
+import os
+import zlib
+
+import caching
+
+logger = logging.getLogger(__name__)
+
+# Every record is a single line: the CRC32 of its JSON body in hex, a space,
+# and the body itself. A record is only trusted once its newline is on disk
+# and the checksum matches, so a write torn by a crash is simply dropped.
+
+def encode_record(record):
+    body = json.dumps(
+        record, cls=caching.DiscordSupportJSONEncoder,
+        sort_keys=True, separators=(",", ":")
+    )
+    return f"{zlib.crc32(body.encode('utf-8')):08x} {body}\n"
+
+def read_journal_file(filename):
+    try:
+        with open(filename, "rb") as file:
+            data = file.read()
+    except FileNotFoundError:
+        return [], 0
+    records = []
+    offset = intact_length = 0
+    for line in data.splitlines(keepends=True):
+        offset += len(line)
+        if not line.endswith(b"\n"):
+            logger.warning("Skipping torn final record in %s", filename)
+            break
+        checksum, _, body = line.rstrip(b"\r\n").partition(b" ")
+        try:
+            valid = int(checksum, 16) == zlib.crc32(body)
+        except ValueError:
+            valid = False
+        if not valid:
+            logger.warning("Skipping corrupted record in %s (byte %d)", filename, offset - len(line))
+            continue
+        records.append(body.decode("utf-8"))
+        intact_length = offset
+    return records, intact_length
+
+class VoteJournal:
+    def __init__(self, filename):
+        self.filename = filename
+        self.seq = 0
+        self.records = 0
+        self.bytes_written = 0
+        self.file = None
+
+    def segments(self):
+        directory, base = os.path.split(os.path.abspath(self.filename))
+        if not os.path.isdir(directory):
+            return []
+        found = []
+        for name in os.listdir(directory):
+            suffix = name[len(base)+1:]
+            if name.startswith(base + ".") and suffix.isdigit():
+                found.append((int(suffix), os.path.join(directory, name)))
+        return sorted(found)
+
+    def recover(self):
+        records = []
+        for seq, filename in self.segments():
+            records += read_journal_file(filename)[0]
+        tail, intact_length = read_journal_file(self.filename)
+        records += tail
+        if os.path.exists(self.filename) and os.path.getsize(self.filename) > intact_length:
+            # Appending after a torn record would glue the next one onto it.
+            with open(self.filename, "r+b") as file:
+                file.truncate(intact_length)
+        return records
+
+    def open(self):
+        if self.file is None:
+            self.file = open(self.filename, "a", encoding="utf-8", newline="\n")
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def append(self, record):
+        self.seq += 1
+        record["seq"] = self.seq
+        line = encode_record(record)
+        self.file.write(line)
+        self.bytes_written += len(line)
+        self.file.flush()
+        self.records += 1
+
+    def rotate(self):
+        # Moves the current journal aside as a numbered segment, so that a
+        # snapshot covering everything up to `seq` can be written while new
+        # records keep going into a fresh file.
+        was_open = self.file is not None
+        self.close()
+        if os.path.exists(self.filename) and os.path.getsize(self.filename):
+            os.replace(self.filename, f"{self.filename}.{self.seq}")
+        if was_open:
+            self.open()
+        self.records = 0
+        return self.seq
+
+    def discard_segments(self, seq):
+        for segment_seq, filename in self.segments():
+            if segment_seq <= seq:
+                os.remove(filename)
@@ -0,0 +1,76 @@
+import logging
+import logging.handlers
+import queue
+import sys
+
+from utils import shortened
+
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+DEFAULT_QUEUE_SIZE = 10000
+
+# Records tagged with `extra={"event": ...}` can be sampled per event type,
+# e.g. {"message": 10} keeps one in every ten "message" records.
+DEFAULT_SAMPLING = {}
+
+class Shortened:
+    # Defers `utils.shortened` until a record actually gets formatted.
+    __slots__ = ("content", "charlim")
+
+    def __init__(self, content, charlim=64):
+        self.content = content
+        self.charlim = charlim
+
+    def __str__(self):
+        return shortened(self.content, self.charlim)
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+        self.seen = {}
+
+    def filter(self, record):
+        event = getattr(record, "event", None)
+        rate = self.rates.get(event, 1)
+        if rate <= 1:
+            return True
+        count = self.seen.get(event, 0)
+        self.seen[event] = count + 1
+        return count % rate == 0
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    # The event loop must never wait on the log writer, so when the writer
+    # falls behind records are dropped (and counted) instead.
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+_listener = None
+
+def setup_logging(level=logging.INFO, stream=None, sampling=DEFAULT_SAMPLING,
+                  queue_size=DEFAULT_QUEUE_SIZE):
+    global _listener
+    shutdown_logging()
+    log_queue = queue.Queue(queue_size)
+    writer = logging.StreamHandler(stream if stream is not None else sys.stdout)
+    writer.setFormatter(logging.Formatter(LOG_FORMAT))
+    handler = DroppingQueueHandler(log_queue)
+    handler.addFilter(SamplingFilter(sampling))
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.handlers[:] = [handler]
+    _listener = logging.handlers.QueueListener(log_queue, writer)
+    _listener.start()
+    return handler
+
+def shutdown_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
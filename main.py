@@ -1,11 +1,15 @@
+import logging
 import os
 
 import discord
 
 import commands
 import caching
+import events
+import outbound
 import credentials
-from utils import shortened
+import logs
+import metrics
 import modules.defaults
 import modules.pollmaker
 
@@ -13,69 +17,208 @@ DEVELOPMENT_MODE = False
 if DEVELOPMENT_MODE:
     credentials.TOKEN = credentials.DEV_TOKEN 
 
+logger = logging.getLogger(__name__)
+
 DEFAULT_POLL_CACHE_FILENAME = os.path.join("caches", "polls.json")
+DEFAULT_POLL_DATABASE_FILENAME = os.path.join("caches", "polls.db")
+DEFAULT_POLL_CACHE_FLUSH_INTERVAL = 5.0
+DEFAULT_POLL_CACHE_FLUSH_THRESHOLD = 100
+# "snapshot" rewrites the whole cache file, "journal" appends every vote
+# change to a journal that is compacted into the cache file now and then,
+# "sqlite" keeps polls and votes as rows in the database file (importing
+# the cache file the first time).
+DEFAULT_POLL_CACHE_MODE = "snapshot"
+DEFAULT_POLL_JOURNAL_COMPACT_THRESHOLD = 1000
+# Compact cache files leave out indentation and spaces.
+DEFAULT_POLL_CACHE_COMPACT = False
+DEFAULT_CACHE_HYDRATION_CONCURRENCY = 16
+DEFAULT_USER_CACHE_SIZE = 4096
+# Polls that ended longer ago than this many seconds move out of memory
+# into an archive and are read back when a command asks for one of them.
+# None keeps them all loaded.
+DEFAULT_POLL_ARCHIVE_AGE = 7 * 24 * 3600
+DEFAULT_POLL_ARCHIVE_CACHE_SIZE = 32
+# Catch up on votes missed while disconnected, after ready and on resume.
+DEFAULT_RECONCILE_VOTES = True
+# Events are handled by one worker per message they concern (per channel
+# for commands), so reactions to a poll are applied in order. Callers wait
+# once this many are queued (in total, or for one message or channel).
+DEFAULT_MAX_PENDING_EVENTS = events.DEFAULT_MAX_PENDING_EVENTS
+DEFAULT_MAX_QUEUED_EVENTS = events.DEFAULT_MAX_QUEUED_EVENTS
+# Set a port to serve the metrics over HTTP on localhost.
+DEFAULT_METRICS_PORT = None
 
 class HelixClient(discord.Client):
     PREFIX = "&&" if DEVELOPMENT_MODE else "&"
 
-    def __init__(self, *args, poll_cache_file=DEFAULT_POLL_CACHE_FILENAME, **kwargs):
+    def __init__(self, *args, poll_cache_file=DEFAULT_POLL_CACHE_FILENAME,
+                 poll_database_file=DEFAULT_POLL_DATABASE_FILENAME,
+                 poll_cache_flush_interval=DEFAULT_POLL_CACHE_FLUSH_INTERVAL,
+                 poll_cache_flush_threshold=DEFAULT_POLL_CACHE_FLUSH_THRESHOLD,
+                 poll_cache_mode=DEFAULT_POLL_CACHE_MODE,
+                 poll_journal_compact_threshold=DEFAULT_POLL_JOURNAL_COMPACT_THRESHOLD,
+                 poll_cache_compact=DEFAULT_POLL_CACHE_COMPACT,
+                 cache_hydration_concurrency=DEFAULT_CACHE_HYDRATION_CONCURRENCY,
+                 user_cache_size=DEFAULT_USER_CACHE_SIZE,
+                 poll_archive_age=DEFAULT_POLL_ARCHIVE_AGE,
+                 poll_archive_cache_size=DEFAULT_POLL_ARCHIVE_CACHE_SIZE,
+                 reconcile_votes=DEFAULT_RECONCILE_VOTES,
+                 max_pending_events=DEFAULT_MAX_PENDING_EVENTS,
+                 max_queued_events=DEFAULT_MAX_QUEUED_EVENTS,
+                 metrics_port=DEFAULT_METRICS_PORT,
+                 slow_call_threshold=metrics.DEFAULT_SLOW_THRESHOLD,
+                 **kwargs):
         super().__init__(*args, **kwargs)
         self.polls = [] 
         self.polls_by_msgid = {}
         self.poll_cache_file = poll_cache_file
+        self.poll_database_file = poll_database_file
+        self.poll_cache_flush_interval = poll_cache_flush_interval
+        self.poll_cache_flush_threshold = poll_cache_flush_threshold
+        self.poll_cache_mode = poll_cache_mode
+        self.poll_journal_compact_threshold = poll_journal_compact_threshold
+        self.poll_cache_compact = poll_cache_compact
+        self.cache_hydration_concurrency = cache_hydration_concurrency
+        self.user_cache = caching.LRUCache(user_cache_size)
+        self.poll_archive_age = poll_archive_age
+        self.poll_archive_cache_size = poll_archive_cache_size
+        self.reconcile_votes = reconcile_votes
+        self.outbound = self.create_outbound_scheduler()
+        self.metrics = metrics.MetricsRegistry(slow_threshold=slow_call_threshold)
+        self.metrics_port = metrics_port
+        self.events = events.EventDispatcher(
+            max_pending=max_pending_events, max_queued=max_queued_events, metrics=self.metrics
+        )
+        self.metrics_server = None
+        self.metrics.gauge("reactions_dropped_fast_path", lambda: self.fast_path_dropped)
+        self.metrics.gauge("outbound_sent", lambda: self.outbound.sent)
+        self.metrics.gauge("outbound_delayed", lambda: self.outbound.delayed)
+        self.metrics.gauge("outbound_rate_limited", lambda: self.outbound.rate_limited)
         self.listeners = {
-            "on_ready": {}, "finalize": {},
+            "on_ready": {}, "on_resumed": {}, "finalize": {},
             "before_on_message": {}, "after_on_message": {},
             "on_reaction_add": {}, "on_reaction_remove": {},
             "on_message_delete": {}
         }
-        self.command_handler = commands.CommandHandler(prefix=self.PREFIX)
+        # Listeners without an entry here get every event.
+        self.interests = {"on_reaction_add": {}, "on_reaction_remove": {}}
+        self.fast_path_dropped = 0
+        self.command_handler = commands.CommandHandler(prefix=self.PREFIX, metrics=self.metrics)
         modules.defaults.inject_module(self)
         modules.pollmaker.inject_module(self)
         self.ready = False
 
+    def create_outbound_scheduler(self):
+        # Called before the modules are injected, they hold on to it.
+        return outbound.OutboundScheduler(self)
+
+    async def get_cached_user_info(self, user_id):
+        user = self.user_cache.get(user_id)
+        if user is None:
+            user = await self.get_user_info(user_id)
+            self.user_cache.put(user_id, user)
+        return user
+
+    async def call_listeners(self, event, *args, listeners=None):
+        if listeners is None:
+            listeners = self.listeners[event].items()
+        for name, func in listeners:
+            await self.metrics.timed(f"listener.{event}.{name}", func(*args))
+
     async def finalize_and_logout(self):
-        for func in self.listeners["finalize"].values():
-            await func()
+        await self.events.close()
+        await self.call_listeners("finalize")
+        await self.outbound.drain()
+        self.metrics.stop_loop_monitor()
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+            self.metrics_server = None
         await self.logout()
 
     async def on_ready(self):
-        print("Ready!")
+        logger.info("Ready!")
+        self.metrics.start_loop_monitor()
+        if self.metrics_port is not None and self.metrics_server is None:
+            self.metrics_server = await metrics.start_http_endpoint(self.metrics, port=self.metrics_port)
         try:
-            for func in self.listeners["on_ready"].values():
-                await func()
+            await self.call_listeners("on_ready")
         except Exception as e:
             await self.finalize_and_logout()
             raise
         else:
             self.ready = True
 
+    async def on_resumed(self):
+        if not self.ready: return
+        logger.info("Resumed!")
+        await self.call_listeners("on_resumed")
+
+    # The gateway handlers below only queue their events, each returns a
+    # future for when its event has been handled.
+
     async def on_message(self, message):
         if not self.ready: return
-        print(f"Got message: {message} ({shortened(message.content)})")
-        for func in self.listeners["before_on_message"].values():
-            await func(message)
+        logger.debug(
+            "Got message: %s (%s)", message, logs.Shortened(message.content),
+            extra={"event": "message"}
+        )
+        # A channel's commands run in the order they were sent. They aren't
+        # ordered against reactions, those are keyed by the poll's message:
+        # a vote that arrives just before `&stoppoll` may still land after it.
+        return await self.events.submit(
+            message.channel.id, "on_message", self.handle_message, message
+        )
+
+    async def handle_message(self, message):
+        await self.call_listeners("before_on_message", message)
         await self.command_handler.handle_command_call(message.content, message)
-        for func in self.listeners["after_on_message"].values():
-            await func(message)
+        await self.call_listeners("after_on_message", message)
 
     async def on_message_delete(self, message):
         if not self.ready: return
-        for func in self.listeners["on_message_delete"].values():
-            await func(message)
+        return await self.events.submit(
+            message.id, "on_message_delete",
+            self.call_listeners, "on_message_delete", message
+        )
+
+    def interested_listeners(self, event, reaction):
+        interests = self.interests[event]
+        return [
+            (name, func) for name, func in self.listeners[event].items()
+            if name not in interests or interests[name].matches(reaction)
+        ]
+
+    async def call_reaction_listeners(self, event, reaction, user, listeners):
+        await self.call_listeners(event, reaction, user, listeners=listeners)
 
     async def on_reaction_add(self, reaction, user):
         if not self.ready: return
-        print(f"Got reaction {reaction} by {user}")
-        for func in self.listeners["on_reaction_add"].values():
-            await func(reaction, user)
+        listeners = self.interested_listeners("on_reaction_add", reaction)
+        if not listeners:
+            self.fast_path_dropped += 1
+            return
+        logger.debug("Got reaction %s by %s", reaction, user, extra={"event": "reaction"})
+        return await self.events.submit(
+            reaction.message.id, "on_reaction_add",
+            self.call_reaction_listeners, "on_reaction_add", reaction, user, listeners
+        )
 
     async def on_reaction_remove(self, reaction, user):
         if not self.ready: return
-        print(f"Removing reaction {reaction} by {user}")
-        for func in self.listeners["on_reaction_remove"].values():
-            await func(reaction, user)
+        listeners = self.interested_listeners("on_reaction_remove", reaction)
+        if not listeners:
+            self.fast_path_dropped += 1
+            return
+        logger.debug("Removing reaction %s by %s", reaction, user, extra={"event": "reaction"})
+        return await self.events.submit(
+            reaction.message.id, "on_reaction_remove",
+            self.call_reaction_listeners, "on_reaction_remove", reaction, user, listeners
+        )
 
 if __name__ == '__main__':
+    logs.setup_logging(logging.DEBUG if DEVELOPMENT_MODE else logging.INFO)
     client = HelixClient()
-    client.run(credentials.TOKEN)
+    try:
+        client.run(credentials.TOKEN)
+    finally:
+        logs.shutdown_logging()
@@ -0,0 +1,159 @@
+import asyncio
+import logging
+import math
+import re
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SLOW_THRESHOLD = 0.25
+DEFAULT_RESERVOIR_SIZE = 2048
+DEFAULT_LOOP_LAG_INTERVAL = 0.5
+QUANTILES = (0.5, 0.95, 0.99)
+
+class Histogram:
+    # Percentiles come from the most recent samples only, count, sum and
+    # max cover everything since startup.
+    __slots__ = ("count", "total", "max", "samples")
+
+    def __init__(self, reservoir_size=DEFAULT_RESERVOIR_SIZE):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = deque(maxlen=reservoir_size)
+
+    def observe(self, value):
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+        self.samples.append(value)
+
+    def quantiles(self, qs=QUANTILES):
+        ordered = sorted(self.samples)
+        if not ordered:
+            return {q: 0.0 for q in qs}
+        return {
+            q: ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+            for q in qs
+        }
+
+class MetricsRegistry:
+    def __init__(self, slow_threshold=DEFAULT_SLOW_THRESHOLD):
+        self.slow_threshold = slow_threshold
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self._loop_monitor = None
+
+    def histogram(self, name):
+        if name not in self.histograms:
+            self.histograms[name] = Histogram()
+        return self.histograms[name]
+
+    def observe(self, name, seconds):
+        self.histogram(name).observe(seconds)
+        if seconds >= self.slow_threshold:
+            logger.warning("Slow call: %s took %.3fs", name, seconds)
+
+    async def timed(self, name, coro):
+        start = time.monotonic()
+        try:
+            return await coro
+        finally:
+            self.observe(name, time.monotonic() - start)
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def gauge(self, name, func):
+        # `func` is only called when the metrics are read.
+        self.gauges[name] = func
+
+    def start_loop_monitor(self, interval=DEFAULT_LOOP_LAG_INTERVAL):
+        if self._loop_monitor is None:
+            self._loop_monitor = asyncio.ensure_future(self._monitor_loop(interval))
+
+    def stop_loop_monitor(self):
+        if self._loop_monitor is not None:
+            self._loop_monitor.cancel()
+            self._loop_monitor = None
+
+    async def _monitor_loop(self, interval):
+        # However much longer than `interval` a sleep takes is time the loop
+        # spent busy with something else.
+        histogram = self.histogram("event_loop_lag")
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(interval)
+            histogram.observe(max(0.0, time.monotonic() - start - interval))
+
+    def read_gauges(self):
+        values = {}
+        for name, func in self.gauges.items():
+            try:
+                values[name] = func()
+            except Exception:
+                logger.exception("Couldn't read gauge %s", name)
+        return values
+
+    def summary_lines(self):
+        lines = []
+        for name, histogram in sorted(self.histograms.items()):
+            q = histogram.quantiles()
+            lines.append(
+                f"{name}: n={histogram.count} p50={q[0.5]*1000:.1f}ms "
+                f"p95={q[0.95]*1000:.1f}ms p99={q[0.99]*1000:.1f}ms max={histogram.max*1000:.1f}ms"
+            )
+        for name, value in sorted(self.counters.items()):
+            lines.append(f"{name}: {value}")
+        for name, value in sorted(self.read_gauges().items()):
+            lines.append(f"{name}: {value}")
+        return lines
+
+    def exposition(self, prefix="helix"):
+        # Prometheus text format, so any scraper can poll it.
+        lines = [f"# TYPE {prefix}_latency_seconds summary"]
+        for name, histogram in sorted(self.histograms.items()):
+            label = f'name="{escape_label(name)}"'
+            for q, value in histogram.quantiles().items():
+                lines.append(f'{prefix}_latency_seconds{{{label},quantile="{q}"}} {value:.6f}')
+            lines.append(f"{prefix}_latency_seconds_count{{{label}}} {histogram.count}")
+            lines.append(f"{prefix}_latency_seconds_sum{{{label}}} {histogram.total:.6f}")
+            lines.append(f"{prefix}_latency_seconds_max{{{label}}} {histogram.max:.6f}")
+        for name, value in sorted(self.counters.items()):
+            metric = f"{prefix}_{metric_name(name)}_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {value}")
+        for name, value in sorted(self.read_gauges().items()):
+            metric = f"{prefix}_{metric_name(name)}"
+            lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+def metric_name(name):
+    return re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+def escape_label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+async def start_http_endpoint(registry, host="127.0.0.1", port=9464):
+    async def handle(reader, writer):
+        try:
+            # Whatever was asked for, the answer is the metrics.
+            await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 5)
+            body = registry.exposition().encode("utf-8")
+            writer.write(
+                b"HTTP/1.0 200 OK\r\n"
+                b"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                + f"Content-Length: {len(body)}\r\n\r\n".encode("ascii") + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+    server = await asyncio.start_server(handle, host, port)
+    logger.info("Serving metrics on http://%s:%d/", host, port)
+    return server
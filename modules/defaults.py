@@ -1,18 +1,34 @@
 import types
 import importlib
+import logging
 from . import pollmaker
 from utils import is_admin
 
+logger = logging.getLogger(__name__)
+
+STATS_MESSAGE_LIMIT = 1900
+
 async def leave(self, message):
     if is_admin(message.author):
         await self.finalize_and_logout()
 
+async def stats(self, message):
+    if not is_admin(message.author):
+        await self.outbound.send_message(message.channel, "Only admins can see my stats :lock:")
+        return False
+    text = "\n".join(self.metrics.summary_lines())
+    if len(text) > STATS_MESSAGE_LIMIT:
+        text = text[:STATS_MESSAGE_LIMIT] + "\n..."
+    await self.outbound.send_message(message.channel, f"```\n{text}\n```")
+    return True
+
 async def reload_pollmaker(self, message):
-    print("Reloading pollmaker...")
+    logger.info("Reloading pollmaker...")
     importlib.reload(pollmaker)
+    await self.write_poll_cache()
     pollmaker.eject_module(self)
     pollmaker.inject_module(self)
-    print("Done")
+    logger.info("Done")
 
 def inject_module(client):
     def bound(func): return types.MethodType(func, client)
@@ -20,6 +36,7 @@ def inject_module(client):
         "defaults",
         (
             ("leave", bound(leave)),
+            ("stats", bound(stats)),
             ("reload_pollmaker", bound(reload_pollmaker))
         )
     )
@@ -1,12 +1,26 @@
+import csv
+import gzip
+import heapq
+import io
 import json
+import logging
+import shutil
+import tempfile
 import types
-import os
 import caching
+import events
+import outbound
+import storage
+import tally
 import asyncio
+import re
+import time
 
 import discord
 
-from utils import is_admin
+from utils import chunked, is_admin, paginate
+
+logger = logging.getLogger(__name__)
 
 ENGLISH_NUMBERS = [
     "zero", "one", "two", "three", "four", 
@@ -26,39 +40,144 @@ UNICODE_EMOJI_NUMBERS = [
 EMOJI_NUMBERS_TO_INT = {
     c: i for i, c in enumerate(UNICODE_EMOJI_NUMBERS)
 }
+REACTION_USERS_PAGE_SIZE = 100
+REACTION_FETCH_CONCURRENCY = 4
+RECONCILE_CONCURRENCY = 4
+POLL_ARCHIVE_INTERVAL = 3600
+DURATION_UNITS = {"d": 86400, "h": 3600, "m": 60, "s": 1}
+DURATION_PATTERN = re.compile(r"(?:(\d+)d)?(?:(\d+)h)?(?:(\d+)m)?(?:(\d+)s)?")
+# Polls close within a year, anything later is a typo (and past some
+# point not even a date).
+MAX_POLL_DURATION = 366 * 86400
+TALLY_METHODS = {
+    "irv": tally.instant_runoff,
+    "borda": tally.borda,
+    "approval": tally.approval,
+}
+RANK_RECEIVED_EMOJI = "🗳"
+EXPORT_FORMATS = ("csv", "jsonl")
+EXPORT_FIELDS = ("poll", "option", "user_id", "display_name")
+EXPORT_CHUNK_SIZE = 500
+EXPORT_NAME_CACHE_SIZE = 10000
+# Discord's upload limit, bigger exports are sent gzipped.
+EXPORT_ATTACHMENT_LIMIT = 8 * 2**20
+
+def parse_duration(value):
+    # Seconds, or a string like "90s", "15m" or "1d12h".
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        seconds = value
+    elif isinstance(value, str):
+        match = DURATION_PATTERN.fullmatch(value.strip().lower())
+        if match is None or not any(match.groups()):
+            raise ValueError(f"Invalid duration: {value!r}")
+        seconds = sum(
+            int(amount) * DURATION_UNITS[unit]
+            for amount, unit in zip(match.groups(), "dhms") if amount is not None
+        )
+    else:
+        raise ValueError(f"Invalid duration: {value!r}")
+    if not 0 < seconds <= MAX_POLL_DURATION:
+        raise ValueError(f"Duration must be positive and at most {MAX_POLL_DURATION} seconds")
+    return seconds
 
-def create_poll_template_text(options, poll_index, title=None):
+def poll_deadline(kwargs, now):
+    if "closes_at" in kwargs:
+        closes_at = kwargs["closes_at"]
+        if (isinstance(closes_at, bool) or not isinstance(closes_at, (int, float))
+                or not now < closes_at <= now + MAX_POLL_DURATION):
+            raise ValueError(f"Invalid closing time: {closes_at!r}")
+        return float(closes_at)
+    if "duration" in kwargs:
+        return now + parse_duration(kwargs["duration"])
+    return None
+
+def create_poll_template_text(options, poll_index, title=None, counts=None, closes_at=None):
     if not (2 <= len(options) <= len(UNICODE_EMOJI_NUMBERS)):
         raise ValueError("Invalid option count")
     template = f"A new poll (ID {str(poll_index).zfill(3)}) is approaching!\n=====\n"
     if title is not None:
         template += title + "\n"
     for i in range(len(options)):
-        template += f"{UNICODE_EMOJI_NUMBERS[i+1]}: {options[i]}\n"
+        template += f"{UNICODE_EMOJI_NUMBERS[i+1]}: {options[i]}"
+        if counts is not None:
+            template += f" [{counts[i]}]"
+        template += "\n"
+    if closes_at is not None:
+        template += time.strftime("Voting closes at %Y-%m-%d %H:%M UTC.", time.gmtime(closes_at))
     return template.strip()
 
+def poll_message_text(poll):
+    # Live polls show their current counts, other poll messages never
+    # change after they're sent.
+    if poll.live and poll.votes is not None:
+        return create_poll_template_text(
+            poll.options, poll.poll_index+1, poll.title,
+            [len(voters) for voters in poll.votes], poll.closes_at
+        )
+    return poll.poll_message.content
+
+def render_live_results(poll):
+    return poll_message_text(poll) if poll.active else None
+
 class PollModel:
-    def __init__(self, poll_index=None, author=None, 
-                       poll_message=None, options=[], owner=None):
+    __slots__ = (
+        "poll_index", "author", "poll_message", "message_id", "options",
+        "owner", "votes", "voters", "active", "dead", "journal", "last_activity",
+        "revision", "summary", "title", "live", "closes_at", "archived", "ballots"
+    )
+
+    def __init__(self, poll_index=None, author=None, poll_message=None,
+                       options=[], owner=None, title=None, live=False, closes_at=None):
         self.poll_index = poll_index
         self.author = author
+        # author, poll_message and owner may also be cache references,
+        # those are only resolved once something needs them.
         self.poll_message = poll_message
+        self.message_id = caching.cached_id(poll_message)
         self.options = options
         self.owner = owner
-        self.votes = [[] for _ in range(len(self.options))]
+        # votes[option] is the set of IDs of users voting for that option,
+        # voters[user ID] is the set of options that user voted for.
+        self.votes = [set() for _ in range(len(self.options))]
+        self.voters = {}
         self.active = True
         self.dead = False
+        self.journal = None
+        # When a vote or the poll's state last changed, in seconds since
+        # the epoch.
+        self.last_activity = time.time()
+        # Bumped on every vote change, `summary` is the rendered results as
+        # (revision, pages) for as long as that revision is current.
+        self.revision = 0
+        self.summary = None
+        self.title = title
+        self.live = live
+        # When the poll ends by itself, in seconds since the epoch.
+        self.closes_at = closes_at
+        self.archived = False
+        # Everyone's ranking of the options from `&rank`.
+        self.ballots = tally.BallotBox(len(self.options))
 
     def create_cache(self):
+        if self.archived:
+            # Only holds the index, the poll itself is in the archive.
+            return dict(storage.DEAD_POLL_CACHE)
         return {
             "poll_index": self.poll_index, 
             "author": self.author,
             "poll_message": self.poll_message,
             "options": self.options,
             "owner": self.owner,
-            "votes": self.votes,
+            "votes": None if self.votes is None else [sorted(voters) for voters in self.votes],
+            "ballots": None if self.ballots is None else {
+                user_id: list(ranking) for user_id, ranking in self.ballots.rankings.items()
+            },
             "active": self.active,
-            "dead": self.dead
+            "dead": self.dead,
+            "last_activity": self.last_activity,
+            "title": self.title,
+            "live": self.live,
+            "closes_at": self.closes_at
         }
 
     @classmethod
@@ -67,21 +186,70 @@ class PollModel:
         obj.poll_index = cache["poll_index"]
         obj.author = cache["author"]
         obj.poll_message = cache["poll_message"]
+        obj.message_id = caching.cached_id(obj.poll_message)
         obj.options = cache["options"]
         obj.owner = cache["owner"]
-        obj.votes = cache["votes"]
+        if cache["votes"] is None:
+            # Left in storage, see `poll_votes`.
+            obj.votes = None
+        else:
+            obj.votes = [set() for _ in range(len(obj.options))]
+            for option, voters in enumerate(cache["votes"]):
+                for user in voters:
+                    if user is not None:
+                        obj.insert_vote(option, caching.cached_id(user))
+        ballots = cache.get("ballots", {})
+        # Left in storage like the votes, see `poll_ballots`.
+        obj.ballots = None if ballots is None else tally.BallotBox(len(obj.options), {
+            user_id: tuple(ranking) for user_id, ranking in ballots.items()
+        })
         obj.active = cache["active"]
         obj.dead = cache["dead"]
+        obj.last_activity = cache.get("last_activity", 0.0)
+        obj.title = cache.get("title")
+        obj.live = cache.get("live", False)
+        obj.closes_at = cache.get("closes_at")
         return obj
 
+    def start_journal(self, vote_journal):
+        self.journal = vote_journal
+        self.record("new", poll=self.create_cache())
+
+    def record(self, op, **data):
+        if self.journal is not None:
+            self.journal.append(dict(data, op=op, msg=self.message_id))
+
+    def replay(self, record):
+        op = record["op"]
+        if op == "add":
+            self.insert_vote(record["option"], caching.cached_id(record["user"]))
+        elif op == "erase":
+            self.discard_vote(record["option"], caching.cached_id(record["user"]))
+        elif op == "rank":
+            self.put_ballot(record["user"], record["ranking"])
+        elif op == "clear":
+            self.replace_votes([set() for _ in self.options])
+        elif op == "reset":
+            self.replace_votes([set(voters) for voters in record["votes"]])
+        elif op == "deactivate":
+            self.deactivate()
+        elif op == "kill":
+            self.kill()
+
     def deactivate(self):
         self.active = False
+        self.last_activity = time.time()
+        self.record("deactivate")
 
     def kill(self):
+        self.record("kill")
+        self.journal = None
         self.active = False
         self.dead = True
-        self.poll_index = self.author = self.poll_message = None
-        self.options, self.votes = [], []
+        self.poll_index = self.author = self.poll_message = self.message_id = None
+        self.options, self.votes, self.voters = [], [], {}
+        self.ballots = tally.BallotBox(0)
+        self.summary = None
 
     def get_emoji_as_index(self, reaction):
         opt = EMOJI_NUMBERS_TO_INT[reaction.emoji]-1
@@ -90,86 +258,711 @@ class PollModel:
         else:
             return opt
 
+    def insert_vote(self, option, user_id):
+        voters = self.votes[option]
+        if user_id in voters:
+            return False
+        voters.add(user_id)
+        self.voters.setdefault(user_id, set()).add(option)
+        self.revision += 1
+        return True
+
+    def discard_vote(self, option, user_id):
+        voters = self.votes[option]
+        if user_id not in voters:
+            return False
+        voters.remove(user_id)
+        options = self.voters[user_id]
+        options.remove(option)
+        if not options:
+            del self.voters[user_id]
+        self.revision += 1
+        return True
+
+    def replace_votes(self, votes):
+        self.votes = votes
+        self.voters = {}
+        for option, voters in enumerate(votes):
+            for user_id in voters:
+                self.voters.setdefault(user_id, set()).add(option)
+        self.revision += 1
+        self.record("reset", votes=[sorted(voters) for voters in votes])
+
     def add_vote(self, reaction, user):
-        if self.owner == user: return False
+        if caching.cached_id(self.owner) == user.id: return False
         try:
-            self.votes[self.get_emoji_as_index(reaction)].append(user)
-        except (KeyError, IndexError, AssertionError):
+            option = self.get_emoji_as_index(reaction)
+        except (KeyError, IndexError):
             return False
-        else:
-            return True
+        if not self.insert_vote(option, user.id):
+            return False
+        self.record("add", option=option, user=user.id)
+        self.last_activity = time.time()
+        return True
 
     def erase_vote(self, reaction, user):
-        if self.owner == user: return False
+        if caching.cached_id(self.owner) == user.id: return False
         try:
-            self.votes[self.get_emoji_as_index(reaction)].remove(user)
-        except (KeyError, IndexError, ValueError, AssertionError):
+            option = self.get_emoji_as_index(reaction)
+        except (KeyError, IndexError):
             return False
-        else:
-            return True
+        if not self.discard_vote(option, user.id):
+            return False
+        self.record("erase", option=option, user=user.id)
+        self.last_activity = time.time()
+        return True
+
+    def put_ballot(self, user_id, ranking):
+        self.ballots.put(user_id, ranking)
+
+    def set_ballot(self, user_id, ranking):
+        # An empty ranking withdraws the ballot.
+        self.put_ballot(user_id, ranking)
+        self.record("rank", user=user_id, ranking=list(ranking))
+        self.last_activity = time.time()
+
+    def set_option_voters(self, option, user_ids):
+        # Brings one option in line with who reacted with it, as individual
+        # additions and removals so the other options are left alone.
+        current = self.votes[option]
+        added, erased = user_ids - current, current - user_ids
+        for user_id in added:
+            self.insert_vote(option, user_id)
+            self.record("add", option=option, user=user_id)
+        for user_id in erased:
+            self.discard_vote(option, user_id)
+            self.record("erase", option=option, user=user_id)
+        if added or erased:
+            self.last_activity = time.time()
+        return len(added) + len(erased)
+
+    @classmethod
+    def placeholder(cls):
+        obj = cls()
+        obj.active = False
+        obj.dead = True
+        return obj
+
+# Takes the place of every archived poll in the registry, see `get_poll`.
+ARCHIVED_POLL = PollModel.placeholder()
+ARCHIVED_POLL.dead = False
+ARCHIVED_POLL.archived = True
+
+class PollIndexAllocator:
+    # Hands out the lowest free poll index: the heap holds indices of dead
+    # polls, anything from `size` on was never handed out.
+    def __init__(self, polls=()):
+        self.rebuild(polls)
+
+    def rebuild(self, polls):
+        self.free = [i for i, poll in enumerate(polls) if poll.dead]
+        heapq.heapify(self.free)
+        self.size = len(polls)
+
+    def allocate(self):
+        if self.free:
+            return heapq.heappop(self.free)
+        self.size += 1
+        return self.size - 1
+
+    def release(self, index):
+        heapq.heappush(self.free, index)
+
+def place_poll(polls, poll):
+    # Polls can be placed out of order when their creation overlaps, the
+    # gap is filled with dead polls until the missing one arrives.
+    while len(polls) < poll.poll_index:
+        polls.append(PollModel.placeholder())
+    if poll.poll_index < len(polls):
+        polls[poll.poll_index] = poll
+    else:
+        polls.append(poll)
+
+def replay_journal_record(polls, polls_by_msgid, record):
+    if record["op"] == "new":
+        poll = PollModel.load_from_cache(record["poll"])
+        place_poll(polls, poll)
+        polls_by_msgid[poll.message_id] = poll
+        return
+    poll = polls_by_msgid.get(record["msg"])
+    if poll is None:
+        return
+    poll.replay(record)
+    if poll.dead:
+        del polls_by_msgid[record["msg"]]
+    while polls and polls[-1].dead:
+        polls.pop()
 
 async def load_cached_polls(self):
-    if self.poll_cache_file is None:
+    if self.poll_storage is None:
         return
-    path = os.path.join(os.getcwd(), self.poll_cache_file)
-    print(f"Looking for poll cache in {path}")
-    try:
-        with open(self.poll_cache_file, "r", encoding="utf-8") as file:
-            raw_cache = file.read()
-    except FileNotFoundError:
-        print("No cache was found.")
+    loaded = self.poll_storage.load()
+    if loaded is None:
         return True
-    print("Loading polls from cache.")
-    hook = caching.discord_support_decoder_hook_factory(self)
+    logger.info("Loading polls from cache.")
+    # Discord objects stay as references here, see `hydrate_poll`.
+    cache, records = loaded
+    polls = [PollModel.load_from_cache(sub) for sub in cache]
+    for poll_index in self.poll_storage.archived_indices():
+        while len(polls) <= poll_index:
+            polls.append(PollModel.placeholder())
+        polls[poll_index] = ARCHIVED_POLL
+    polls_by_msgid = {
+        poll.message_id: poll for poll in polls if poll.message_id is not None and not poll.archived
+    }
+    for record in records:
+        replay_journal_record(polls, polls_by_msgid, record)
+    if records:
+        logger.info("Replayed %d journal records.", len(records))
+    self.polls = polls
+    self.poll_indices.rebuild(polls)
+    # Anything overdue closes in one batch as soon as hydration is done.
+    self.arm_poll_expiry()
+    if self.poll_storage.journal is not None:
+        for poll in self.polls:
+            if not poll.dead:
+                poll.journal = self.poll_storage.journal
+    # Updated in place, the reaction interests hold on to this dict.
+    self.polls_by_msgid.clear()
+    self.polls_by_msgid.update(polls_by_msgid)
+    logger.info("Loaded successfully!")
+    self.poll_hydration = asyncio.ensure_future(self.hydrate_active_polls())
+
+async def handle_ready(self):
+    # After `load_cached_polls`, whether or not there was anything to load.
+    self.start_poll_archiving()
+
+async def hydrate_poll(self, poll):
+    if caching.is_cached_reference(poll.poll_message):
+        poll.poll_message = await caching.resolve_cached_object(self, poll.poll_message)
+        if poll.poll_message is not None:
+            # Reactions are only reported on messages the client keeps.
+            self.messages.append(poll.poll_message)
+    if poll.poll_message is None:
+        logger.warning("Poll message for poll ID %s is gone, deleting", poll.poll_index)
+        self.retire_poll(poll)
+        self.schedule_poll_cache_write()
+        return False
+    for attr in ("author", "owner"):
+        value = getattr(poll, attr)
+        if caching.is_cached_reference(value):
+            setattr(poll, attr, await caching.resolve_cached_object(self, value))
+    return True
+
+async def hydrate_active_polls(self):
+    # Only active polls need their message right away, so that votes on
+    # them are seen; everything else waits until a command touches it.
+    semaphore = asyncio.Semaphore(self.cache_hydration_concurrency)
+    async def hydrate(poll):
+        async with semaphore:
+            # One poll that can't be hydrated mustn't hold up the rest.
+            try:
+                await self.hydrate_poll(poll)
+            except discord.errors.HTTPException as e:
+                logger.warning("Couldn't hydrate poll ID %s: %r", poll.poll_index, e)
+            except Exception:
+                logger.exception("Couldn't hydrate poll ID %s", poll.poll_index)
+    polls = sorted(
+        (poll for poll in self.polls if poll.active and not poll.dead),
+        key=lambda poll: poll.last_activity, reverse=True
+    )
+    start = time.monotonic()
+    await asyncio.gather(*(hydrate(poll) for poll in polls))
+    logger.info("Hydrated %d active polls in %.2fs", len(polls), time.monotonic() - start)
+    self.mark_live_polls()
+    if self.reconcile_votes:
+        # Hydration just fetched the messages, their reactions are current.
+        self.start_poll_reconciliation(refetch=False)
+
+def arm_poll_expiry(self):
+    for poll in self.polls:
+        if poll.active and not poll.dead and poll.closes_at is not None:
+            self.poll_expiry.schedule(poll.closes_at, poll)
+
+async def end_poll(self, poll):
+    # The poll ends right away, its message may have to be fetched before
+    # it can show that.
+    poll.deactivate()
+    self.live_results.forget(poll.message_id)
+    # A message that's gone, channel or server included, retires the poll.
     try:
-        cache = json.loads(raw_cache, object_hook=hook)
-        await caching.await_all(cache)
-    except json.decoder.JSONDecodeError:
-        print("Failed cache load, aborting. Please clear the cache.")
-        raise
-    for sub in cache:
-        obj = PollModel.load_from_cache(sub)
-        if obj.poll_message is None:
-            print(f"Poll message for poll ID {obj.poll_index} is gone, deleting")
+        if not await self.hydrate_poll(poll):
+            return
+    except discord.errors.HTTPException as e:
+        logger.warning("Couldn't fetch poll ID %s to mark it ended: %r", poll.poll_index, e)
+        return
+    except Exception:
+        logger.exception("Couldn't fetch poll ID %s to mark it ended", poll.poll_index)
+        return
+    self.outbound.fire(
+        "edit_message", poll.poll_message, poll_message_text(poll) + "\n[This poll has ended.]",
+        priority=outbound.PRIORITY_EDIT
+    )
+
+async def expire_polls(self, polls):
+    if self.poll_hydration is not None:
+        # Closing a poll edits its message, hydration fetches them all in
+        # one go instead of `end_poll` one by one. Whether or not it worked,
+        # polls still close.
+        await asyncio.wait([self.poll_hydration])
+    now = time.time()
+    expired = 0
+    for poll in polls:
+        if poll.active and not poll.dead and poll.closes_at is not None and poll.closes_at <= now:
+            await self.end_poll(poll)
+            expired += 1
+    if expired:
+        logger.info("Closed %d expired polls", expired)
+        self.metrics.count("polls_expired", expired)
+        self.schedule_poll_cache_write()
+
+def get_poll(self, poll_id):
+    # Archived polls are read back on demand and kept around for a while,
+    # None if the archive doesn't have it after all.
+    poll = self.polls[poll_id]
+    if not poll.archived:
+        return poll
+    poll = self.archived_polls.get(poll_id)
+    if poll is None:
+        cache = self.poll_storage.load_archived(poll_id)
+        if cache is None:
+            logger.warning("Archived poll ID %s is missing from the archive", poll_id)
+            return None
+        poll = PollModel.load_from_cache(cache)
+        # So that deleting it is journaled like for any other poll.
+        poll.journal = self.poll_storage.journal
+        self.archived_polls.put(poll_id, poll)
+    return poll
+
+async def archive_ended_polls(self):
+    cutoff = time.time() - self.poll_archive_age
+    polls = [
+        poll for poll in self.polls
+        if not poll.active and not poll.dead and not poll.archived and poll.last_activity < cutoff
+    ]
+    if not polls:
+        return 0
+    caches = [poll.create_cache() for poll in polls]
+    loop = asyncio.get_event_loop()
+    await loop.run_in_executor(None, self.poll_storage.archive, caches)
+    archived = 0
+    for poll, cache in zip(polls, caches):
+        index = cache["poll_index"]
+        if self.polls[index] is not poll or poll.active:
+            # Deleted in the meantime.
+            self.poll_storage.drop_archived(index)
             continue
-        self.polls.append(obj)
-        self.messages.append(self.polls[-1].poll_message)
-    self.polls_by_msgid = {
-        poll.poll_message.id: poll for poll in self.polls if poll.poll_message is not None
-    }
-    print("Loaded successfully!")
+        self.polls[index] = ARCHIVED_POLL
+        self.polls_by_msgid.pop(poll.message_id, None)
+        self.live_results.forget(poll.message_id)
+        archived += 1
+    self.metrics.count("polls_archived", archived)
+    # Until this write the cache still has them, which only costs time:
+    # loading puts the archive's placeholders over them.
+    await self.write_poll_cache()
+    logger.info("Archived %d ended polls", archived)
+    return archived
 
-async def write_poll_cache(self):
-    if self.poll_cache_file is None or not self.ready:
+def start_poll_archiving(self):
+    if self.poll_archive_age is None or self.poll_storage is None:
         return
-    print("Updating poll cache!")
-    dlist = [poll.create_cache() for poll in self.polls]
-    with open(self.poll_cache_file, "w", encoding="utf-8") as file:
-        s = json.dumps(
-            dlist, cls=caching.DiscordSupportJSONEncoder,
-            sort_keys=True, indent=4
-        )
-        file.write(s)
-    return s
+    if self.poll_archiving is not None and not self.poll_archiving.done():
+        return
+    async def archive_periodically():
+        if self.poll_hydration is not None:
+            # Startup work goes first, archiving goes ahead even if it failed.
+            await asyncio.wait([self.poll_hydration])
+        while True:
+            # Shielded, the archive files may already be on their way to
+            # disk when this is cancelled, see `close_poll_cache`.
+            self.poll_archive_sweep = asyncio.ensure_future(self.archive_ended_polls())
+            try:
+                await asyncio.shield(self.poll_archive_sweep)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Couldn't archive ended polls")
+            await asyncio.sleep(POLL_ARCHIVE_INTERVAL)
+    self.poll_archiving = asyncio.ensure_future(archive_periodically())
+
+def snapshot_poll_cache(self):
+    if self.poll_storage is None or not self.ready:
+        return None
+    return self.poll_storage.prepare(self.polls)
+
+def schedule_poll_cache_write(self):
+    # With a durable journal votes are already safe, this only compacts it.
+    if self.poll_storage is not None and self.poll_storage.write_due():
+        self.poll_cache_flusher.mark_dirty()
+
+async def write_poll_cache(self):
+    self.poll_cache_flusher.mark_dirty()
+    return await self.poll_cache_flusher.flush()
+
+async def close_poll_cache(self):
+    if self.poll_reconciliation is not None:
+        self.poll_reconciliation.cancel()
+    if self.poll_archiving is not None:
+        self.poll_archiving.cancel()
+    if self.poll_archive_sweep is not None and not self.poll_archive_sweep.done():
+        try:
+            await self.poll_archive_sweep
+        except Exception:
+            logger.exception("Couldn't archive ended polls")
+    self.live_results.close()
+    self.poll_expiry.close()
+    await self.poll_cache_flusher.close()
+    if self.poll_storage is not None:
+        self.poll_storage.close()
+    flusher = self.poll_cache_flusher
+    logger.info(
+        "Poll cache flusher: %d writes for %d changes (%d coalesced)",
+        flusher.flushes, flusher.requests, flusher.coalesced
+    )
 
 async def assert_updated_poll_cache(self, message):
+    # Commands don't wait for the write, the flusher gets to it within its
+    # interval; shutdown and reload wait for it.
     if self.polls_changed:
-        await self.write_poll_cache()
+        self.schedule_poll_cache_write()
         self.polls_changed = False
 
+def poll_votes(self, poll):
+    if poll.votes is None:
+        return self.poll_storage.load_votes(poll)
+    return poll.votes
+
+def poll_ballots(self, poll):
+    if poll.ballots is None:
+        return tally.BallotBox(len(poll.options), self.poll_storage.load_ballots(poll))
+    return poll.ballots
+
+def parse_ranking(poll, args):
+    # Option numbers as on the poll message, most preferred first.
+    ranking = [int(arg) - 1 for arg in args]
+    if any(option not in range(len(poll.options)) for option in ranking):
+        raise ValueError("Option index out of bounds.")
+    if len(set(ranking)) != len(ranking):
+        raise ValueError("Option ranked twice.")
+    return ranking
+
+async def tally_poll(self, poll, method):
+    # Large electorates take a while to count even vectorized, so that
+    # happens off the event loop, on a copy of the ballots.
+    ballots = self.poll_ballots(poll)
+    loop = asyncio.get_event_loop()
+    result = await loop.run_in_executor(
+        None, TALLY_METHODS[method], ballots.snapshot(), len(poll.options)
+    )
+    return len(ballots), result
+
+def render_tally(poll, method, voters, result):
+    if method == "irv":
+        winner, rounds = result
+        lines = [f"Instant runoff results for that poll, from {voters} rankings:"]
+        eliminated = set()
+        for number, (counts, loser) in enumerate(rounds, 1):
+            line = f"Round {number}: " + ", ".join(
+                f"{poll.options[option]} [{count}]"
+                for option, count in enumerate(counts) if option not in eliminated
+            )
+            if loser is not None:
+                line += f". Out: {poll.options[loser]}"
+                eliminated.add(loser)
+            lines.append(line)
+        lines.append(f"Winner: {poll.options[winner]} :trophy:")
+    else:
+        label = "Borda scores" if method == "borda" else "Approvals"
+        lines = [f"{label} for that poll, from {voters} rankings:"]
+        ranked = sorted(zip(result, range(len(poll.options))), key=lambda pair: -pair[0])
+        lines += [f"{poll.options[option]} [{score}]" for score, option in ranked]
+    return paginate(lines)
+
+async def get_voter_name(self, server, user_id):
+    member = server.get_member(user_id) if server is not None else None
+    if member is not None:
+        return member.display_name
+    try:
+        user = await self.get_cached_user_info(user_id)
+    except discord.errors.NotFound:
+        return user_id
+    return user.display_name
+
+async def get_voter_names(self, server, user_ids):
+    user_ids = list(user_ids)
+    semaphore = asyncio.Semaphore(REACTION_FETCH_CONCURRENCY)
+    async def get_name(user_id):
+        async with semaphore:
+            return await self.get_voter_name(server, user_id)
+    names = await asyncio.gather(*(get_name(user_id) for user_id in user_ids))
+    return dict(zip(user_ids, names))
+
+async def render_poll_summary(self, poll):
+    # Rendered once per revision of the poll's votes, so names changed in
+    # between only show up with the next vote.
+    revision = poll.revision
+    if poll.summary is not None and poll.summary[0] == revision:
+        return poll.summary[1]
+    votes = self.poll_votes(poll)
+    names = await self.get_voter_names(poll.poll_message.server, set().union(*votes))
+    lines = ["Here are the results for that poll:"]
+    for option, voters in zip(poll.options, votes):
+        lines.append(f"{option} [{len(voters)}]: " + ", ".join(sorted(names[uid] for uid in voters)))
+    pages = paginate(lines)
+    if poll.revision == revision:
+        poll.summary = (revision, pages)
+    return pages
+
 async def get_poll_index(self, message, args):
     if len(args) > 1:    
-        await self.send_message(message.channel, "You gave me too many arguments. :question:")
+        await self.outbound.send_message(message.channel, "You gave me too many arguments. :question:")
         return None
     try:
         poll_id = int(args[0].lstrip('0'))-1
         if poll_id not in range(len(self.polls)) or self.polls[poll_id].dead:
             raise IndexError("No living poll on such index.")
+        poll = self.get_poll(poll_id)
+        if poll is None:
+            raise IndexError("No living poll on such index.")
     except (ValueError, IndexError):
-        await self.send_message(message.channel, "That's not a valid ID :angry:.")
+        await self.outbound.send_message(message.channel, "That's not a valid ID :angry:.")
         return None
+    if not await self.hydrate_poll(poll):
+        await self.outbound.send_message(message.channel, "That poll's message is gone, so I deleted it. :wastebasket:")
+        return None
+    return poll_id
+
+def poll_server_id(poll):
+    # Without hydrating the poll, its message may still be a reference.
+    message = poll.poll_message
+    if caching.is_cached_reference(message):
+        return caching.cached_id(message["channel"]["server"])
+    return message.server.id
+
+def iter_poll_votes(self, poll):
+    # (option, user ID) pairs. Votes left in storage are streamed from
+    # there, loaded ones are copied an option at a time, since they can
+    # change while an export waits for names.
+    if poll.votes is None:
+        yield from self.poll_storage.iter_votes(poll)
+        return
+    for option, voters in enumerate(poll.votes):
+        for user_id in sorted(voters):
+            yield option, user_id
+
+def iter_server_polls(self, server_id):
+    # Archived polls are read back one at a time and not kept around.
+    poll_id = 0
+    while poll_id < len(self.polls):
+        poll = self.polls[poll_id]
+        poll_id += 1
+        if poll.dead:
+            continue
+        if poll.archived:
+            cache = self.poll_storage.load_archived(poll_id - 1)
+            if cache is None:
+                continue
+            poll = PollModel.load_from_cache(cache)
+        if poll_server_id(poll) == server_id:
+            yield poll
+
+async def export_rows(self, polls, server):
+    # Rows of (poll ID, option, user ID, display name). Votes are named a
+    # chunk at a time, which is all that's ever held besides a bounded
+    # cache of the names that took an API call: the same voters come up
+    # poll after poll.
+    known = caching.LRUCache(EXPORT_NAME_CACHE_SIZE)
+    for poll in polls:
+        poll_id, options = poll.poll_index + 1, poll.options
+        for chunk in chunked(self.iter_poll_votes(poll), EXPORT_CHUNK_SIZE):
+            names, missing = {}, set()
+            for _, user_id in chunk:
+                if user_id in names:
+                    continue
+                name = known.get(user_id)
+                if name is None:
+                    # Members are named on the spot, only other users need
+                    # a lookup through the API.
+                    member = server.get_member(user_id) if server is not None else None
+                    name = member.display_name if member is not None else None
+                if name is None:
+                    missing.add(user_id)
+                else:
+                    names[user_id] = name
+            for user_id, name in (await self.get_voter_names(server, missing)).items():
+                names[user_id] = name
+                known.put(user_id, name)
+            for option, user_id in chunk:
+                yield poll_id, options[option], user_id, names[user_id]
+
+async def write_export(rows, file, export_format):
+    count = 0
+    if export_format == "csv":
+        writer = csv.writer(file)
+        writer.writerow(EXPORT_FIELDS)
+        async for row in rows:
+            writer.writerow(row)
+            count += 1
     else:
-        return poll_id
+        async for row in rows:
+            file.write(json.dumps(dict(zip(EXPORT_FIELDS, row)), ensure_ascii=False) + "\n")
+            count += 1
+    return count
+
+def compress_export(source, target):
+    source.seek(0)
+    with gzip.GzipFile(fileobj=target, mode="wb") as compressed:
+        shutil.copyfileobj(source, compressed)
+
+async def send_export(self, channel, polls, server, export_format, name):
+    # Returns how many votes were exported, None if even the compressed
+    # file is too big to upload.
+    with tempfile.TemporaryFile() as raw, tempfile.TemporaryFile() as compressed:
+        file = io.TextIOWrapper(raw, encoding="utf-8", newline="")
+        count = await write_export(self.export_rows(polls, server), file, export_format)
+        file.flush()
+        file.detach()
+        upload, filename = raw, f"{name}.{export_format}"
+        if raw.tell() > EXPORT_ATTACHMENT_LIMIT:
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(None, compress_export, raw, compressed)
+            upload, filename = compressed, filename + ".gz"
+            if compressed.tell() > EXPORT_ATTACHMENT_LIMIT:
+                return None
+        upload.seek(0)
+        await self.outbound.send_file(
+            channel, upload, filename=filename, content=f"Here you go, {count} votes. :page_facing_up:"
+        )
+    return count
+
+async def fetch_all_reaction_users(self, reaction):
+    users = []
+    after = None
+    while True:
+        page = await self.get_reaction_users(reaction, limit=REACTION_USERS_PAGE_SIZE, after=after)
+        users += page
+        if len(page) < REACTION_USERS_PAGE_SIZE:
+            return users
+        after = page[-1]
+
+async def fetch_option_voters(self, poll, reactions):
+    # Returns {option: set of user IDs} for the given reactions on the poll.
+    semaphore = asyncio.Semaphore(REACTION_FETCH_CONCURRENCY)
+    async def fetch(option, reaction):
+        async with semaphore:
+            users = await self.fetch_all_reaction_users(reaction)
+        owner_id = caching.cached_id(poll.owner)
+        return option, {user.id for user in users if user.id != owner_id}
+    fetches = []
+    for reaction in reactions:
+        try:
+            fetches.append(fetch(poll.get_emoji_as_index(reaction), reaction))
+        except (KeyError, IndexError):
+            pass
+    return dict(await asyncio.gather(*fetches))
+
+async def reread_poll_votes(self, poll):
+    poll_message = await self.get_message(poll.poll_message.channel, poll.message_id)
+    option_voters = await self.fetch_option_voters(poll, poll_message.reactions)
+    poll.replace_votes([option_voters.get(i, set()) for i in range(len(poll.options))])
+    self.update_live_results(poll)
+
+def reaction_option_counts(poll, reactions):
+    # {option: (reaction, votes)} as Discord counts them, minus the bot's
+    # own reaction, which it adds to every option.
+    counts = {}
+    for reaction in reactions:
+        try:
+            option = poll.get_emoji_as_index(reaction)
+        except (KeyError, IndexError):
+            continue
+        counts[option] = (reaction, reaction.count - (1 if reaction.me else 0))
+    return counts
+
+async def reconcile_poll(self, poll, message=None):
+    # Catches up on reactions missed while disconnected. Only options whose
+    # count disagrees get their users fetched; a vote swapped for another
+    # on the same option keeps the count, only `&reread_votes` sees that.
+    if message is None:
+        try:
+            message = await self.get_message(poll.poll_message.channel, poll.message_id)
+        except discord.errors.NotFound:
+            logger.warning("Poll message for poll ID %s is gone, deleting", poll.poll_index)
+            self.retire_poll(poll)
+            self.schedule_poll_cache_write()
+            return 0
+    counts = reaction_option_counts(poll, message.reactions)
+    stale = [
+        reaction for option, (reaction, count) in counts.items()
+        if count != len(poll.votes[option])
+    ]
+    option_voters = await self.fetch_option_voters(poll, stale) if stale else {}
+    if not poll.active:
+        return 0
+    for option, voters in enumerate(poll.votes):
+        if option not in counts and voters:
+            option_voters[option] = set()
+    self.metrics.count("poll_reconcile_options_fetched", len(stale))
+    changed = sum(
+        poll.set_option_voters(option, user_ids)
+        for option, user_ids in option_voters.items()
+    )
+    if changed:
+        self.update_live_results(poll)
+    return changed
+
+async def reconcile_active_polls(self, refetch=True):
+    # The most recently active polls are the likeliest to have missed
+    # votes, so they go first.
+    polls = sorted(
+        (poll for poll in self.polls if poll.active and not poll.dead
+         and not caching.is_cached_reference(poll.poll_message)),
+        key=lambda poll: poll.last_activity, reverse=True
+    )
+    semaphore = asyncio.Semaphore(RECONCILE_CONCURRENCY)
+    async def reconcile(poll):
+        async with semaphore:
+            if not poll.active:
+                return 0
+            try:
+                return await self.reconcile_poll(poll, None if refetch else poll.poll_message)
+            except discord.errors.HTTPException as e:
+                logger.warning("Couldn't reconcile poll ID %s: %r", poll.poll_index, e)
+                return 0
+    start = time.monotonic()
+    changed = sum(await asyncio.gather(*(reconcile(poll) for poll in polls)))
+    self.metrics.count("poll_reconcile_votes_changed", changed)
+    self.mark_live_polls()
+    if changed:
+        self.schedule_poll_cache_write()
+    logger.info(
+        "Reconciled %d active polls in %.2fs, %d votes changed",
+        len(polls), time.monotonic() - start, changed
+    )
+    return changed
+
+def start_poll_reconciliation(self, refetch=True):
+    # A pass still running is working from what it saw before the latest
+    # reconnect, a fresh one replaces it.
+    if self.poll_reconciliation is not None and not self.poll_reconciliation.done():
+        self.poll_reconciliation.cancel()
+    self.poll_reconciliation = asyncio.ensure_future(self.reconcile_active_polls(refetch))
+
+async def handle_resume(self):
+    if self.reconcile_votes:
+        self.start_poll_reconciliation()
+
+def update_live_results(self, poll):
+    if poll.live:
+        self.live_results.mark(poll.poll_message, poll)
+
+def mark_live_polls(self):
+    # Live poll messages may be behind their votes after a restart or a
+    # reconnect, those whose text is still current aren't edited.
+    for poll in self.polls:
+        if (poll.live and poll.active and not poll.dead
+                and not caching.is_cached_reference(poll.poll_message)):
+            self.update_live_results(poll)
 
 async def handle_reaction_addition(self, reaction, user):
     if (reaction.message.id not in self.polls_by_msgid):
@@ -177,9 +970,12 @@ async def handle_reaction_addition(self, reaction, user):
     poll = self.polls_by_msgid[reaction.message.id]
     if not poll.active:
         return
+    if caching.is_cached_reference(poll.poll_message):
+        poll.poll_message = reaction.message
     success = poll.add_vote(reaction, user)
     if success:
-        await self.write_poll_cache()
+        self.schedule_poll_cache_write()
+        self.update_live_results(poll)
 
 async def handle_reaction_removal(self, reaction, user):
     if (reaction.message.id not in self.polls_by_msgid):
@@ -189,13 +985,27 @@ async def handle_reaction_removal(self, reaction, user):
         return
     success = poll.erase_vote(reaction, user)
     if success:
-        await self.write_poll_cache()
+        self.schedule_poll_cache_write()
+        self.update_live_results(poll)
+
+def retire_poll(self, poll):
+    index = poll.poll_index
+    self.live_results.forget(poll.message_id)
+    self.polls_by_msgid.pop(poll.message_id, None)
+    poll.kill()
+    if self.polls[index].archived:
+        self.poll_storage.drop_archived(index)
+        self.archived_polls.pop(index)
+        self.polls[index] = poll
+    self.poll_indices.release(index)
+    while self.polls and self.polls[-1].dead:
+        self.polls.pop()
 
 async def handle_poll_message_removal(self, message):
     if message.id in self.polls_by_msgid:
-        self.polls_by_msgid[message.id].kill()
+        self.retire_poll(self.polls_by_msgid[message.id])
         self.polls_changed = True
-    await self.assert_updated_poll_cache()
+    await self.assert_updated_poll_cache(message)
 
 
 class PollmakerCommands:
@@ -204,26 +1014,42 @@ class PollmakerCommands:
             args, kwargs = self.command_handler.command_find_args(message.content)
             if any(not isinstance(o, str) for o in args):
                 raise ValueError("(At least) one of the arguments was not a string")
-            for i in range(len(self.polls)):
-                if self.polls[i].dead:
-                    poll_index = i
-                    break
-            else:
-                poll_index = len(self.polls)
-            template = create_poll_template_text(args, poll_index+1, kwargs.get("title", None))
+            title, live = kwargs.get("title", None), bool(kwargs.get("live", False))
+            closes_at = poll_deadline(kwargs, time.time())
+            poll_index = self.poll_indices.allocate()
+            try:
+                template = create_poll_template_text(
+                    args, poll_index+1, title, [0] * len(args) if live else None, closes_at
+                )
+            except BaseException:
+                self.poll_indices.release(poll_index)
+                raise
         except (SyntaxError, ValueError):
-            await self.send_message(message.channel, "Sorry, I couldn't create the poll :frowning:")
+            await self.outbound.send_message(message.channel, "Sorry, I couldn't create the poll :frowning:")
             return False
         else:
-            poll_message = await self.send_message(message.channel, template)
-            poll = PollModel(poll_index, message.author, poll_message, args, message.server.me)
-            if poll_index < len(self.polls):
-                self.polls[poll_index] = poll
-            else:
-                self.polls.append(poll)
-            self.polls_by_msgid[poll.poll_message.id] = poll
+            try:
+                poll_message = await self.outbound.send_message(message.channel, template)
+            except BaseException:
+                self.poll_indices.release(poll_index)
+                raise
+            poll = PollModel(
+                poll_index, message.author, poll_message, args, message.server.me,
+                title, live, closes_at
+            )
+            place_poll(self.polls, poll)
+            self.polls_by_msgid[poll.message_id] = poll
+            if self.poll_storage is not None and self.poll_storage.journal is not None:
+                poll.start_journal(self.poll_storage.journal)
+            if closes_at is not None:
+                self.poll_expiry.schedule(closes_at, poll)
+            # The reactions trickle in behind the command, and never in
+            # front of anyone's replies.
             for i in range(len(poll.options)):
-                await self.add_reaction(poll.poll_message, UNICODE_EMOJI_NUMBERS[i+1])
+                self.outbound.fire(
+                    "add_reaction", poll.poll_message, UNICODE_EMOJI_NUMBERS[i+1],
+                    priority=outbound.PRIORITY_DECORATION
+                )
             self.polls_changed = True
             return True
 
@@ -231,16 +1057,15 @@ class PollmakerCommands:
         args = message.content.split()[1:]
         poll_id = await self.get_poll_index(message, args)
         if poll_id is not None:
-            poll = self.polls[poll_id]
+            poll = self.get_poll(poll_id)
             if not poll.active:
-                await self.send_message(message.channel, "I have already deactivated that poll.")
+                await self.outbound.send_message(message.channel, "I have already deactivated that poll.")
                 return False
             if not (poll.author == message.author or is_admin(message.author)):
-                await self.send_message(message.channel, "That's not your poll :exclamation:")
+                await self.outbound.send_message(message.channel, "That's not your poll :exclamation:")
                 return False
-            await self.edit_message(poll.poll_message, poll.poll_message.content + "\n[This poll has ended.]")
-            poll.deactivate()
-            await self.send_message(message.channel, "I deactivated that poll. :bulb:")
+            await self.end_poll(poll)
+            await self.outbound.send_message(message.channel, "I deactivated that poll. :bulb:")
             self.polls_changed = True
             return True
 
@@ -248,19 +1073,19 @@ class PollmakerCommands:
         args = message.content.split()[1:]
         poll_id = await self.get_poll_index(message, args)
         if poll_id is not None:
-            poll = self.polls[poll_id]
+            poll = self.get_poll(poll_id)
             if poll.dead:
-                await self.send_message(message.channel, "I have already deleted that poll.")
+                await self.outbound.send_message(message.channel, "I have already deleted that poll.")
                 return False
             if not (poll.author == message.author or is_admin(message.author)):
-                await self.send_message(message.channel, "That's not your poll :exclamation:")
+                await self.outbound.send_message(message.channel, "That's not your poll :exclamation:")
                 return False
-            await self.edit_message(poll.poll_message, poll.poll_message.content + "\n[This poll's results were deleted and you can no longer vote officially in it.]")
-            del self.polls_by_msgid[poll.poll_message.id]
-            poll.kill()
-            await self.send_message(message.channel, "I took care of that poll. :bread:")
-            while self.polls and self.polls[-1].dead:
-                self.polls.pop()
+            self.outbound.fire(
+                "edit_message", poll.poll_message, poll_message_text(poll) + "\n[This poll's results were deleted and you can no longer vote officially in it.]",
+                priority=outbound.PRIORITY_EDIT
+            )
+            self.retire_poll(poll)
+            await self.outbound.send_message(message.channel, "I took care of that poll. :bread:")
             self.polls_changed = True
             return True
 
@@ -268,44 +1093,160 @@ class PollmakerCommands:
         args = message.content.split()[1:]
         poll_id = await self.get_poll_index(message, args)
         if poll_id is not None:
-            poll = self.polls[poll_id]
-            text = ""
-            for option, voters in zip(poll.options, poll.votes):
-                print(option, voters)
-                text += f"{option} [{len(voters)}]: ";
-                text += ", ".join(v.display_name for v in voters)
-                text += "\n"
-            text = text.strip()
-            await self.send_message(message.channel, "Here are the results for that poll:\n" + text)
+            poll = self.get_poll(poll_id)
+            for page in await self.render_poll_summary(poll):
+                await self.outbound.send_message(message.channel, page)
+
+    async def rank_options(self, message):
+        args = message.content.split()[1:]
+        poll_id = await self.get_poll_index(message, args[:1])
+        if poll_id is not None:
+            poll = self.get_poll(poll_id)
+            if not poll.active:
+                await self.outbound.send_message(message.channel, "That poll has ended, its votes are final.")
+                return False
+            try:
+                ranking = parse_ranking(poll, args[1:])
+            except ValueError:
+                await self.outbound.send_message(message.channel, "Rank that poll's options by their numbers, each once. :question:")
+                return False
+            poll.set_ballot(message.author.id, ranking)
+            # A reaction instead of a reply, there may be thousands of these.
+            self.outbound.fire(
+                "add_reaction", message, RANK_RECEIVED_EMOJI,
+                priority=outbound.PRIORITY_DECORATION
+            )
+            self.polls_changed = True
+            return True
+
+    async def list_results(self, message):
+        args = message.content.split()[1:]
+        method = args.pop().lower() if len(args) > 1 else "irv"
+        if method not in TALLY_METHODS:
+            await self.outbound.send_message(message.channel, f"I can count {', '.join(TALLY_METHODS)}. :question:")
+            return False
+        poll_id = await self.get_poll_index(message, args)
+        if poll_id is not None:
+            poll = self.get_poll(poll_id)
+            voters, result = await self.tally_poll(poll, method)
+            if not voters:
+                await self.outbound.send_message(message.channel, "Nobody has ranked that poll's options yet.")
+                return False
+            for page in render_tally(poll, method, voters, result):
+                await self.outbound.send_message(message.channel, page)
+            return True
+
+    async def export_poll(self, message):
+        args = message.content.split()[1:]
+        export_format = args.pop().lower() if len(args) > 1 else "csv"
+        if export_format not in EXPORT_FORMATS:
+            await self.outbound.send_message(message.channel, f"I can export {', '.join(EXPORT_FORMATS)}. :question:")
+            return False
+        if args == ["all"]:
+            if not is_admin(message.author):
+                await self.outbound.send_message(message.channel, "Only admins can export every poll at once :exclamation:")
+                return False
+            polls = self.iter_server_polls(message.server.id)
+            server, name = message.server, f"polls-{message.server.id}"
+        else:
+            poll_id = await self.get_poll_index(message, args)
+            if poll_id is None:
+                return False
+            poll = self.get_poll(poll_id)
+            polls = [poll]
+            server, name = poll.poll_message.server, f"poll-{str(poll_id + 1).zfill(3)}"
+        if await self.send_export(message.channel, polls, server, export_format, name) is None:
+            await self.outbound.send_message(message.channel, "That's too much to upload, even compressed. :frowning:")
+            return False
+        return True
 
     async def reread_votes(self, message):
         args = message.content.split()[1:]
         poll_id = await self.get_poll_index(message, args)
         if poll_id is not None:
-            poll = self.polls[poll_id]
+            poll = self.get_poll(poll_id)
             if not (poll.author == message.author or is_admin(message.author)):
-                await self.send_message(message.channel, "That's not your poll :exclamation:")
+                await self.outbound.send_message(message.channel, "That's not your poll :exclamation:")
+                return False
+            if not poll.active:
+                await self.outbound.send_message(message.channel, "That poll has ended, its votes are final.")
                 return False
-            for v in poll.votes:
-                v.clear()
-            for reaction in poll.poll_message.reactions:
-                user_list = await self.get_reaction_users(reaction, limit=100)
-                for user in user_list:
-                    await handle_reaction_addition(self, reaction, user)
-            await self.send_message(message.channel, "Done rereading :)")
+            await self.reread_poll_votes(poll)
+            self.polls_changed = True
+            await self.outbound.send_message(message.channel, "Done rereading :)")
             return True
 
 def inject_module(client):
     def bound(func): return types.MethodType(func, client)
     client.polls_changed = False
+    client.poll_hydration = None
+    client.poll_reconciliation = None
+    client.poll_archiving = None
+    client.poll_archive_sweep = None
+    client.archived_polls = caching.LRUCache(client.poll_archive_cache_size)
+    client.metrics.gauge("poll_archive_cache_hits", lambda: client.archived_polls.hits)
+    client.metrics.gauge("poll_archive_cache_misses", lambda: client.archived_polls.misses)
+    # The storage outlives module reloads, since live polls append to it.
+    if not hasattr(client, "poll_storage"):
+        client.poll_storage = storage.open_poll_storage(
+            client.poll_cache_mode, client.poll_cache_file, client.poll_database_file,
+            client.poll_journal_compact_threshold, compact=client.poll_cache_compact,
+            metrics=client.metrics
+        )
+    client.poll_cache_flusher = caching.CoalescingFlusher(
+        bound(snapshot_poll_cache), client.poll_storage and client.poll_storage.write,
+        interval=client.poll_cache_flush_interval,
+        threshold=client.poll_cache_flush_threshold
+    )
+    client.schedule_poll_cache_write = bound(schedule_poll_cache_write)
+    client.live_results = outbound.LiveEditScheduler(client.outbound, render_live_results)
+    client.update_live_results = bound(update_live_results)
+    client.mark_live_polls = bound(mark_live_polls)
+    client.poll_expiry = events.DeadlineScheduler(bound(expire_polls))
+    client.arm_poll_expiry = bound(arm_poll_expiry)
+    client.end_poll = bound(end_poll)
+    client.metrics.gauge("live_result_edits", lambda: client.live_results.edits)
+    client.metrics.gauge("live_result_edits_skipped", lambda: client.live_results.skipped)
+    client.metrics.gauge("poll_cache_write_requests", lambda: client.poll_cache_flusher.requests)
+    client.metrics.gauge("poll_cache_writes_coalesced", lambda: client.poll_cache_flusher.coalesced)
     client.write_poll_cache = bound(write_poll_cache)
     client.get_poll_index = bound(get_poll_index)
+    client.poll_indices = PollIndexAllocator(client.polls)
+    client.retire_poll = bound(retire_poll)
+    client.get_poll = bound(get_poll)
+    client.archive_ended_polls = bound(archive_ended_polls)
+    client.start_poll_archiving = bound(start_poll_archiving)
+    client.poll_votes = bound(poll_votes)
+    client.poll_ballots = bound(poll_ballots)
+    client.tally_poll = bound(tally_poll)
+    client.iter_poll_votes = bound(iter_poll_votes)
+    client.iter_server_polls = bound(iter_server_polls)
+    client.export_rows = bound(export_rows)
+    client.send_export = bound(send_export)
+    client.get_voter_name = bound(get_voter_name)
+    client.get_voter_names = bound(get_voter_names)
+    client.render_poll_summary = bound(render_poll_summary)
+    client.hydrate_poll = bound(hydrate_poll)
+    client.hydrate_active_polls = bound(hydrate_active_polls)
+    client.fetch_all_reaction_users = bound(fetch_all_reaction_users)
+    client.fetch_option_voters = bound(fetch_option_voters)
+    client.reread_poll_votes = bound(reread_poll_votes)
+    client.reconcile_poll = bound(reconcile_poll)
+    client.reconcile_active_polls = bound(reconcile_active_polls)
+    client.start_poll_reconciliation = bound(start_poll_reconciliation)
     client.assert_updated_poll_cache = bound(assert_updated_poll_cache)
     client.listeners["on_ready"]["pollmaker_load"] = bound(load_cached_polls)
-    client.listeners["finalize"]["pollmaker_write"] = client.write_poll_cache
+    client.listeners["on_ready"]["pollmaker_archive"] = bound(handle_ready)
+    client.listeners["on_resumed"]["pollmaker_reconcile"] = bound(handle_resume)
+    client.listeners["finalize"]["pollmaker_write"] = bound(close_poll_cache)
     client.listeners["after_on_message"]["pollmaker_update"] = client.assert_updated_poll_cache
     client.listeners["on_reaction_add"]["pollmaker_update"] = bound(handle_reaction_addition)
     client.listeners["on_reaction_remove"]["pollmaker_update"] = bound(handle_reaction_removal)
+    poll_reactions = events.ReactionInterest(
+        message_ids=client.polls_by_msgid, emojis=EMOJI_NUMBERS_TO_INT
+    )
+    client.interests["on_reaction_add"]["pollmaker_update"] = poll_reactions
+    client.interests["on_reaction_remove"]["pollmaker_update"] = poll_reactions
     client.listeners["on_message_delete"]["pollmaker_delete"] = bound(handle_poll_message_removal)
     client.command_handler.add_command_group(
         "pollmaker",
@@ -314,19 +1255,74 @@ def inject_module(client):
             ("stoppoll", bound(PollmakerCommands.stop_poll)),
             ("delpoll", bound(PollmakerCommands.del_poll)),
             ("votes", bound(PollmakerCommands.list_votes)),
+            ("rank", bound(PollmakerCommands.rank_options)),
+            ("results", bound(PollmakerCommands.list_results)),
+            ("exportpoll", bound(PollmakerCommands.export_poll)),
             ("reread_votes", bound(PollmakerCommands.reread_votes))
         )
     )
+    # Polls outlive module reloads, their deadlines have to be set again.
+    # Only once everything is bound, these call back into the client.
+    client.arm_poll_expiry()
+    if getattr(client, "ready", False):
+        client.start_poll_archiving()
 
 def eject_module(client):
+    # Whatever is still pending gets written out by the old flusher,
+    # the fresh one from `inject_module` starts clean.
+    asyncio.ensure_future(client.poll_cache_flusher.close())
     del client.polls_changed
+    del client.poll_hydration
+    del client.poll_reconciliation
+    if client.poll_archiving is not None:
+        client.poll_archiving.cancel()
+    del client.poll_archiving
+    del client.poll_archive_sweep
+    del client.archived_polls
+    del client.poll_cache_flusher
+    del client.schedule_poll_cache_write
+    client.live_results.close()
+    del client.live_results
+    del client.update_live_results
+    del client.mark_live_polls
+    client.poll_expiry.close()
+    del client.poll_expiry
+    del client.arm_poll_expiry
+    del client.end_poll
     del client.write_poll_cache
     del client.get_poll_index
+    del client.poll_indices
+    del client.retire_poll
+    del client.get_poll
+    del client.archive_ended_polls
+    del client.start_poll_archiving
+    del client.poll_votes
+    del client.poll_ballots
+    del client.tally_poll
+    del client.iter_poll_votes
+    del client.iter_server_polls
+    del client.export_rows
+    del client.send_export
+    del client.get_voter_name
+    del client.get_voter_names
+    del client.render_poll_summary
+    del client.hydrate_poll
+    del client.hydrate_active_polls
+    del client.fetch_all_reaction_users
+    del client.fetch_option_voters
+    del client.reread_poll_votes
+    del client.reconcile_poll
+    del client.reconcile_active_polls
+    del client.start_poll_reconciliation
     del client.assert_updated_poll_cache
     del client.listeners["on_ready"]["pollmaker_load"]
+    del client.listeners["on_ready"]["pollmaker_archive"]
+    del client.listeners["on_resumed"]["pollmaker_reconcile"]
     del client.listeners["finalize"]["pollmaker_write"]
     del client.listeners["after_on_message"]["pollmaker_update"]
     del client.listeners["on_reaction_add"]["pollmaker_update"]
     del client.listeners["on_reaction_remove"]["pollmaker_update"]
+    del client.interests["on_reaction_add"]["pollmaker_update"]
+    del client.interests["on_reaction_remove"]["pollmaker_update"]
     del client.listeners["on_message_delete"]["pollmaker_delete"]
     client.command_handler.remove_command_group("pollmaker")
@@ -0,0 +1,294 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_REPLY = 0
+PRIORITY_EDIT = 1
+PRIORITY_DECORATION = 2
+
+# Discord doesn't publish its limits up front, these are the per-channel
+# ones it has been advertising in X-RateLimit-* headers. Anything that
+# reports real headers can correct them through `update_bucket`.
+ROUTE_LIMITS = {
+    "send_message": (5, 5.0),
+    "edit_message": (5, 5.0),
+    "add_reaction": (1, 0.25),
+}
+DEFAULT_ROUTE_LIMIT = (5, 5.0)
+# Uploads are messages as far as Discord's limits go.
+ROUTE_ALIASES = {"send_file": "send_message"}
+GLOBAL_LIMIT = (50, 1.0)
+# Live edits get part of a channel's edit_message limit, the rest is left
+# for commands; each message is edited at most once per interval.
+LIVE_EDIT_INTERVAL = 10.0
+LIVE_CHANNEL_LIMIT = (3, 5.0)
+LIVE_GLOBAL_LIMIT = (20, 1.0)
+LIVE_EDIT_TICK = 0.5
+
+def route_key(method, target):
+    channel = getattr(target, "channel", target)
+    return ROUTE_ALIASES.get(method, method), channel.id
+
+def response_status(exc):
+    return getattr(getattr(exc, "response", None), "status", None)
+
+class RouteBucket:
+    def __init__(self, limit, per):
+        self.limit = limit
+        self.per = per
+        self.remaining = limit
+        self.reset_at = 0.0
+
+    def reserve(self, now):
+        # Takes one request slot, returns how long to wait before using it.
+        if now >= self.reset_at:
+            self.remaining = self.limit
+            self.reset_at = now + self.per
+        if self.remaining > 0:
+            self.remaining -= 1
+            return 0.0
+        delay = self.reset_at - now
+        self.remaining = self.limit - 1
+        self.reset_at += self.per
+        return delay
+
+    def update(self, remaining, reset_after, now):
+        self.remaining = remaining
+        self.reset_at = now + reset_after
+
+class PriorityGate:
+    # The global limit is shared by all routes, so whoever is waiting with
+    # the most urgent priority gets the next free slot.
+    def __init__(self, bucket):
+        self.bucket = bucket
+        self.waiters = []
+        self.counter = itertools.count()
+        self.task = None
+
+    async def acquire(self, priority):
+        future = asyncio.get_event_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self.counter), future))
+        if self.task is None:
+            self.task = asyncio.ensure_future(self._release())
+        await future
+
+    async def _release(self):
+        try:
+            while self.waiters:
+                delay = self.bucket.reserve(time.monotonic())
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                _, _, future = heapq.heappop(self.waiters)
+                if not future.cancelled():
+                    future.set_result(None)
+        finally:
+            self.task = None
+
+class OutboundRequest:
+    __slots__ = ("method", "args", "kwargs", "future")
+
+    def __init__(self, method, args, kwargs, future):
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.future = future
+
+class OutboundScheduler:
+    # Sits between commands and the client's API methods. Requests on the
+    # same route go out one by one, in priority order and paced by that
+    # route's bucket, while different routes proceed independently.
+    def __init__(self, client, route_limits=ROUTE_LIMITS, global_limit=GLOBAL_LIMIT):
+        self.client = client
+        self.route_limits = route_limits
+        self.gate = PriorityGate(RouteBucket(*global_limit))
+        self.buckets = {}
+        self.queues = {}
+        self.workers = {}
+        self.counter = itertools.count()
+        self.sent = 0
+        self.delayed = 0
+        self.rate_limited = 0
+
+    def bucket(self, route):
+        if route not in self.buckets:
+            limit, per = self.route_limits.get(route[0], DEFAULT_ROUTE_LIMIT)
+            self.buckets[route] = RouteBucket(limit, per)
+        return self.buckets[route]
+
+    def update_bucket(self, route, remaining, reset_after):
+        self.bucket(route).update(remaining, reset_after, time.monotonic())
+
+    def submit(self, method, target, *args, priority=PRIORITY_REPLY, **kwargs):
+        future = asyncio.get_event_loop().create_future()
+        route = route_key(method, target)
+        request = OutboundRequest(
+            getattr(self.client, method), (target,) + args, kwargs, future
+        )
+        heapq.heappush(
+            self.queues.setdefault(route, []),
+            (priority, next(self.counter), request)
+        )
+        if route not in self.workers:
+            self.workers[route] = asyncio.ensure_future(self._serve(route))
+        return future
+
+    def send_message(self, channel, *args, **kwargs):
+        return self.submit("send_message", channel, *args, **kwargs)
+
+    def send_file(self, channel, *args, **kwargs):
+        return self.submit("send_file", channel, *args, **kwargs)
+
+    def edit_message(self, message, *args, priority=PRIORITY_EDIT, **kwargs):
+        return self.submit("edit_message", message, *args, priority=priority, **kwargs)
+
+    def add_reaction(self, message, emoji, priority=PRIORITY_DECORATION):
+        return self.submit("add_reaction", message, emoji, priority=priority)
+
+    def fire(self, method, target, *args, **kwargs):
+        # For requests nobody waits on; failures still get reported.
+        future = self.submit(method, target, *args, **kwargs)
+        future.add_done_callback(self._report_failure)
+        return future
+
+    @staticmethod
+    def _report_failure(future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.warning("Outbound request failed: %r", future.exception())
+
+    async def _serve(self, route):
+        queue = self.queues[route]
+        bucket = self.bucket(route)
+        try:
+            while queue:
+                priority, _, request = heapq.heappop(queue)
+                if request.future.cancelled():
+                    continue
+                delay = bucket.reserve(time.monotonic())
+                if delay > 0:
+                    self.delayed += 1
+                    await asyncio.sleep(delay)
+                await self.gate.acquire(priority)
+                try:
+                    result = await request.method(*request.args, **request.kwargs)
+                except Exception as e:
+                    if response_status(e) == 429:
+                        self.rate_limited += 1
+                        bucket.update(0, bucket.per, time.monotonic())
+                    if not request.future.cancelled():
+                        request.future.set_exception(e)
+                else:
+                    self.sent += 1
+                    if not request.future.cancelled():
+                        request.future.set_result(result)
+        finally:
+            del self.workers[route]
+            if not queue:
+                del self.queues[route]
+
+    async def drain(self):
+        while self.workers:
+            await asyncio.gather(*self.workers.values(), return_exceptions=True)
+
+class LiveEditScheduler:
+    # Keeps messages showing live state up to date without flooding their
+    # channels. `mark` says a message's text may have changed, all marks
+    # until its next turn come down to one edit, and none at all if the
+    # text turns out the same. Messages in a channel take turns within the
+    # channel's budget, channels take turns within the global one.
+    # `render(item)` returns the current text, or None to stop editing.
+    def __init__(self, scheduler, render, interval=LIVE_EDIT_INTERVAL,
+                 channel_limit=LIVE_CHANNEL_LIMIT, global_limit=LIVE_GLOBAL_LIMIT,
+                 tick=LIVE_EDIT_TICK):
+        self.scheduler = scheduler
+        self.render = render
+        self.interval = interval
+        self.channel_limit = channel_limit
+        self.tick = tick
+        self.global_bucket = RouteBucket(*global_limit)
+        self.buckets = {}
+        self.channels = OrderedDict()
+        self.texts = {}
+        self.edited = {}
+        self.task = None
+        self.edits = 0
+        self.skipped = 0
+
+    def mark(self, message, item):
+        queue = self.channels.setdefault(message.channel.id, OrderedDict())
+        if message.id not in queue:
+            queue[message.id] = (message, item)
+        if self.task is None:
+            self.task = asyncio.ensure_future(self._run())
+
+    def forget(self, message_id):
+        for queue in self.channels.values():
+            queue.pop(message_id, None)
+        self.texts.pop(message_id, None)
+        self.edited.pop(message_id, None)
+
+    async def _run(self):
+        try:
+            while self.channels:
+                self.send_due(time.monotonic())
+                await asyncio.sleep(self.tick)
+        finally:
+            self.task = None
+
+    def send_due(self, now):
+        for channel_id in list(self.channels):
+            if not has_room(self.global_bucket, now):
+                return
+            queue = self.channels[channel_id]
+            if channel_id not in self.buckets:
+                self.buckets[channel_id] = RouteBucket(*self.channel_limit)
+            bucket = self.buckets[channel_id]
+            for message_id in list(queue):
+                if not (has_room(bucket, now) and has_room(self.global_bucket, now)):
+                    break
+                if now < self.edited.get(message_id, now - self.interval) + self.interval:
+                    continue
+                message, item = queue.pop(message_id)
+                text = self.render(item)
+                if text is None:
+                    self.forget(message_id)
+                elif text == self.texts.get(message_id, message.content):
+                    self.skipped += 1
+                else:
+                    bucket.reserve(now)
+                    self.global_bucket.reserve(now)
+                    self.texts[message_id] = text
+                    self.edited[message_id] = now
+                    self.edits += 1
+                    self.scheduler.fire("edit_message", message, text, priority=PRIORITY_EDIT)
+            # Whoever didn't get a turn goes first next time.
+            self.channels.move_to_end(channel_id)
+            if not queue:
+                del self.channels[channel_id]
+        for channel_id, bucket in list(self.buckets.items()):
+            if channel_id not in self.channels and now >= bucket.reset_at:
+                del self.buckets[channel_id]
+
+    def flush(self):
+        # Every pending mark as an edit right away, past the live budgets;
+        # the outbound scheduler still paces them per route.
+        for queue in self.channels.values():
+            for message_id, (message, item) in queue.items():
+                text = self.render(item)
+                if text is not None and text != self.texts.get(message_id, message.content):
+                    self.texts[message_id] = text
+                    self.edits += 1
+                    self.scheduler.fire("edit_message", message, text, priority=PRIORITY_EDIT)
+        self.channels.clear()
+
+    def close(self):
+        if self.task is not None:
+            self.task.cancel()
+        self.flush()
+
+def has_room(bucket, now):
+    return now >= bucket.reset_at or bucket.remaining > 0
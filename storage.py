@@ -0,0 +1,524 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import caching
+import journal
+
+logger = logging.getLogger(__name__)
+
+# A poll storage persists the poll registry. Both kinds offer:
+#   load()             -> None if nothing is stored, else (caches, records):
+#                         poll caches positioned by poll index, dead polls
+#                         included, and journal records still to replay
+#   journal            -> what live polls append their change records to,
+#                         or None if changes are only seen by snapshots
+#   durable            -> whether appended records are on disk right away
+#   write_due()        -> whether a write is worth scheduling now
+#   prepare(polls)     -> on the event loop, what `write` should persist
+#                         (None to skip)
+#   write(snapshot)    -> in an executor, persists it
+#   load_votes(poll)   -> votes of a poll that was loaded without them
+#   load_ballots(poll) -> the same for its ranked ballots
+#   iter_votes(poll)   -> its votes as (option, user ID) pairs, read as
+#                         they're iterated
+#   archive(caches)    -> in an executor, moves ended polls to the archive,
+#                         readable there once it returns; `load` leaves
+#                         them out from then on
+#   archived_indices() -> poll indices taken by archived polls
+#   load_archived(i)   -> the cache of the archived poll at index i, or None
+#   drop_archived(i)   -> deletes it from the archive
+#   close()
+
+DEAD_POLL_CACHE = {
+    "poll_index": None, "author": None, "poll_message": None, "options": [],
+    "owner": None, "votes": [], "ballots": {}, "active": False, "dead": True
+}
+
+def open_poll_storage(mode, cache_file, database_file, compact_threshold, compact=False, metrics=None):
+    if mode == "sqlite":
+        if database_file is None:
+            return None
+        return SQLitePollStorage(database_file, legacy_file=cache_file, metrics=metrics)
+    if cache_file is None:
+        return None
+    return JSONPollStorage(
+        cache_file, journaling=mode == "journal",
+        compact_threshold=compact_threshold, compact=compact, metrics=metrics
+    )
+
+def encode_poll_snapshot(seq, dlist, compact=False):
+    # Polls refer to the same few servers, channels and members over and
+    # over, so those are written once in "objects", see `ReferenceTable`.
+    table = caching.ReferenceTable()
+    polls = table.intern(dlist)
+    return json.dumps(
+        {"journal_seq": seq, "objects": table.objects, "polls": polls},
+        sort_keys=True, indent=None if compact else 4,
+        separators=(",", ":") if compact else None
+    )
+
+def decode_poll_snapshot(raw):
+    # Returns the journal position and the poll caches, for every format
+    # this file has had.
+    decoder = caching.ReferenceTableDecoder()
+    cache = json.loads(raw, object_hook=decoder)
+    if isinstance(cache, list):
+        # Older caches are a bare list of polls, without a journal position.
+        return 0, cache
+    decoder.resolve(cache.get("objects", {}))
+    return cache["journal_seq"], cache["polls"]
+
+class JSONPollStorage:
+    # The whole registry as one JSON file, rewritten by every write. With
+    # journaling every change is appended to a journal as well, and writes
+    # only compact it. Archived polls get a file each, named by index, in
+    # a directory next to it.
+    def __init__(self, filename, journaling=False, compact_threshold=1000, compact=False, metrics=None):
+        self.filename = filename
+        self.archive_directory = filename + ".archive"
+        self.compact = compact
+        self.vote_journal = journal.VoteJournal(filename + ".journal")
+        self.journaling = journaling
+        self.journal = self.vote_journal if journaling else None
+        self.durable = journaling
+        self.compact_threshold = compact_threshold
+        self.metrics = metrics
+        if metrics is not None:
+            metrics.gauge("poll_journal_bytes", lambda: self.vote_journal.bytes_written)
+
+    def load(self):
+        path = os.path.join(os.getcwd(), self.filename)
+        logger.info("Looking for poll cache in %s", path)
+        try:
+            with open(self.filename, "r", encoding="utf-8") as file:
+                raw_cache = file.read()
+        except FileNotFoundError:
+            logger.info("No cache was found.")
+            raw_cache = None
+        raw_records = self.vote_journal.recover()
+        if self.journaling:
+            self.vote_journal.open()
+        if raw_cache is None and not raw_records:
+            return None
+        try:
+            snapshot_seq, cache = decode_poll_snapshot(raw_cache) if raw_cache else (0, [])
+            records = [json.loads(raw) for raw in raw_records]
+        except json.decoder.JSONDecodeError:
+            logger.error("Failed cache load, aborting. Please clear the cache.")
+            raise
+        records = [record for record in records if record["seq"] > snapshot_seq]
+        self.vote_journal.seq = max([snapshot_seq] + [record["seq"] for record in records])
+        self.vote_journal.records = len(records)
+        return cache, records
+
+    def write_due(self):
+        if self.journaling:
+            return self.vote_journal.records >= self.compact_threshold
+        return True
+
+    def prepare(self, polls):
+        # In journal mode the snapshot is folded over everything journaled
+        # so far, so the records up to now can go once it is safely written.
+        if self.journaling:
+            seq = self.vote_journal.rotate()
+        else:
+            seq = self.vote_journal.seq
+        # The snapshot is serialized in an executor, so it must not share
+        # any mutable state with the live polls.
+        return seq, [poll.create_cache() for poll in polls]
+
+    def write(self, snapshot):
+        seq, dlist = snapshot
+        logger.info("Updating poll cache!")
+        s = encode_poll_snapshot(seq, dlist, self.compact)
+        caching.atomic_write(self.filename, s)
+        if self.metrics is not None:
+            self.metrics.count("poll_cache_write_bytes", len(s.encode("utf-8")))
+            self.metrics.count("poll_cache_writes")
+        self.vote_journal.discard_segments(seq)
+        return s
+
+    def load_votes(self, poll):
+        raise ValueError("JSON storage always loads votes")
+
+    def load_ballots(self, poll):
+        raise ValueError("JSON storage always loads ballots")
+
+    def iter_votes(self, poll):
+        raise ValueError("JSON storage always loads votes")
+
+    def archive_file(self, poll_index):
+        return os.path.join(self.archive_directory, f"{poll_index}.json")
+
+    def archive(self, caches):
+        os.makedirs(self.archive_directory, exist_ok=True)
+        for cache in caches:
+            caching.atomic_write(
+                self.archive_file(cache["poll_index"]),
+                encode_poll_snapshot(0, [cache], compact=True)
+            )
+
+    def archived_indices(self):
+        try:
+            names = os.listdir(self.archive_directory)
+        except FileNotFoundError:
+            return []
+        return [int(name[:-5]) for name in names if name.endswith(".json") and name[:-5].isdigit()]
+
+    def load_archived(self, poll_index):
+        try:
+            with open(self.archive_file(poll_index), "r", encoding="utf-8") as file:
+                return decode_poll_snapshot(file.read())[1][0]
+        except FileNotFoundError:
+            return None
+
+    def drop_archived(self, poll_index):
+        try:
+            os.remove(self.archive_file(poll_index))
+        except FileNotFoundError:
+            pass
+
+    def close(self):
+        self.vote_journal.close()
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS polls (
+    message_id TEXT PRIMARY KEY,
+    poll_index INTEGER NOT NULL,
+    server_id TEXT,
+    channel_id TEXT,
+    author TEXT,
+    poll_message TEXT NOT NULL,
+    owner TEXT,
+    options TEXT NOT NULL,
+    active INTEGER NOT NULL,
+    last_activity REAL NOT NULL DEFAULT 0,
+    title TEXT,
+    live INTEGER NOT NULL DEFAULT 0,
+    closes_at REAL,
+    archived INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS polls_by_index ON polls (poll_index);
+CREATE INDEX IF NOT EXISTS polls_by_server ON polls (server_id, poll_index);
+CREATE TABLE IF NOT EXISTS votes (
+    message_id TEXT NOT NULL,
+    option INTEGER NOT NULL,
+    user_id TEXT NOT NULL,
+    PRIMARY KEY (message_id, option, user_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS ballots (
+    message_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    ranking TEXT NOT NULL,
+    PRIMARY KEY (message_id, user_id)
+) WITHOUT ROWID;
+PRAGMA user_version = 6;
+"""
+
+def encode_reference(obj):
+    return json.dumps(obj, cls=caching.DiscordSupportJSONEncoder, sort_keys=True)
+
+class SQLitePollStorage:
+    # Polls, votes and ballots as rows. The storage is the journal of every live
+    # poll: each change record becomes a few single-row statements, queued
+    # here and committed together in one transaction by `write`. Ended
+    # polls are loaded without their votes and ballots, those are read when needed,
+    # archived ones are only flagged and not loaded at all.
+    durable = False
+    POLL_COLUMNS = (
+        "message_id, poll_index, author, poll_message, owner, options, active, "
+        "last_activity, title, live, closes_at"
+    )
+
+    def __init__(self, filename, legacy_file=None, metrics=None):
+        self.filename = filename
+        self.legacy_file = legacy_file
+        self.metrics = metrics
+        self.journal = self
+        self.pending = []
+        # `append` runs on the event loop, `write` in an executor. Writes
+        # can come from more than one executor thread at once.
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.writer = None
+        self.reader = None
+        if metrics is not None:
+            metrics.gauge("poll_store_pending_statements", lambda: len(self.pending))
+
+    def connect(self):
+        connection = sqlite3.connect(self.filename, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.execute("PRAGMA synchronous = NORMAL")
+        return connection
+
+    def open(self):
+        # Reads go through their own connection, so they never see (or
+        # wait for) a transaction the writer has in progress.
+        self.writer = self.connect()
+        self.reader = self.connect()
+        version = self.writer.execute("PRAGMA user_version").fetchone()[0]
+        if version == 1:
+            self.writer.execute("ALTER TABLE polls ADD COLUMN last_activity REAL NOT NULL DEFAULT 0")
+        if 1 <= version < 3:
+            self.writer.execute("ALTER TABLE polls ADD COLUMN title TEXT")
+            self.writer.execute("ALTER TABLE polls ADD COLUMN live INTEGER NOT NULL DEFAULT 0")
+        if 1 <= version < 4:
+            self.writer.execute("ALTER TABLE polls ADD COLUMN closes_at REAL")
+        if 1 <= version < 5:
+            self.writer.execute("ALTER TABLE polls ADD COLUMN archived INTEGER NOT NULL DEFAULT 0")
+        self.writer.executescript(SQLITE_SCHEMA)
+        return version == 0
+
+    def load(self):
+        logger.info("Opening poll database %s", os.path.join(os.getcwd(), self.filename))
+        if self.open() and self.legacy_file is not None:
+            self.migrate(self.legacy_file)
+        rows = self.reader.execute(
+            f"SELECT {self.POLL_COLUMNS} FROM polls WHERE NOT archived ORDER BY poll_index"
+        ).fetchall()
+        if not rows and self.reader.execute("SELECT 1 FROM polls LIMIT 1").fetchone() is None:
+            return None
+        active_votes = {}
+        for message_id, option, user_id in self.reader.execute(
+            "SELECT votes.message_id, option, user_id FROM votes "
+            "JOIN polls ON polls.message_id = votes.message_id WHERE active AND NOT archived"
+        ):
+            active_votes.setdefault(message_id, []).append((option, user_id))
+        active_ballots = {}
+        for message_id, user_id, ranking in self.reader.execute(
+            "SELECT ballots.message_id, user_id, ranking FROM ballots "
+            "JOIN polls ON polls.message_id = ballots.message_id WHERE active AND NOT archived"
+        ):
+            active_ballots.setdefault(message_id, []).append((user_id, ranking))
+        caches = []
+        for row in rows:
+            while len(caches) < row[1]:
+                caches.append(DEAD_POLL_CACHE)
+            if row[6]:
+                caches.append(self.poll_cache(
+                    row, active_votes.get(row[0], ()), active_ballots.get(row[0], ())
+                ))
+            else:
+                caches.append(self.poll_cache(row, None, None))
+        return caches, []
+
+    @staticmethod
+    def poll_cache(row, votes, ballots):
+        # `votes` are (option, user ID) pairs, `ballots` (user ID, ranking)
+        # pairs, None leaves them in storage.
+        (message_id, poll_index, author, poll_message, owner, options, active,
+         last_activity, title, live, closes_at) = row
+        options = json.loads(options)
+        if votes is not None:
+            voters = [[] for _ in options]
+            for option, user_id in votes:
+                voters[option].append(user_id)
+            votes = voters
+        return {
+            "poll_index": poll_index,
+            "author": json.loads(author),
+            "poll_message": json.loads(poll_message),
+            "options": options,
+            "owner": json.loads(owner),
+            "votes": votes,
+            "ballots": None if ballots is None else {
+                user_id: json.loads(ranking) for user_id, ranking in ballots
+            },
+            "active": bool(active),
+            "dead": False,
+            "last_activity": last_activity,
+            "title": title,
+            "live": bool(live),
+            "closes_at": closes_at
+        }
+
+    def migrate(self, filename):
+        # One-shot import of a JSON poll cache (and its journal) into a new
+        # database. The records replay as statements like any other.
+        loaded = JSONPollStorage(filename).load()
+        if loaded is None:
+            return
+        caches, records = loaded
+        logger.info("Migrating %d polls and %d journal records from %s", len(caches), len(records), filename)
+        for cache in caches:
+            if not cache["dead"]:
+                self.append({"op": "new", "poll": cache, "msg": caching.cached_id(cache["poll_message"])})
+        for record in records:
+            self.append(record)
+        legacy = JSONPollStorage(filename)
+        archived = [legacy.load_archived(poll_index) for poll_index in legacy.archived_indices()]
+        archived = [cache for cache in archived if cache is not None]
+        for cache in archived:
+            self.append({"op": "new", "poll": cache, "msg": caching.cached_id(cache["poll_message"])})
+        self.archive(archived)
+
+    def statements(self, record):
+        op = record["op"]
+        msg = record["msg"]
+        if op == "new":
+            poll = record["poll"]
+            reference = json.loads(encode_reference(poll["poll_message"]))
+            channel = reference["channel"]
+            statements = [
+                ("DELETE FROM votes WHERE message_id = ?", (msg,)),
+                ("DELETE FROM ballots WHERE message_id = ?", (msg,)),
+                ("INSERT OR REPLACE INTO polls VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0)", (
+                    msg, poll["poll_index"], channel["server"]["id"], channel["id"],
+                    encode_reference(poll["author"]), encode_reference(reference),
+                    encode_reference(poll["owner"]), json.dumps(poll["options"]),
+                    int(poll["active"]), poll.get("last_activity", 0.0),
+                    poll.get("title"), int(poll.get("live", False)), poll.get("closes_at")
+                ))
+            ]
+            return statements + self.vote_statements(msg, poll["votes"]) \
+                + self.ballot_statements(msg, poll.get("ballots", {}))
+        elif op == "add":
+            return [(
+                "INSERT OR IGNORE INTO votes VALUES (?, ?, ?)",
+                (msg, record["option"], caching.cached_id(record["user"]))
+            ), self.activity_statement(msg)]
+        elif op == "erase":
+            return [(
+                "DELETE FROM votes WHERE message_id = ? AND option = ? AND user_id = ?",
+                (msg, record["option"], caching.cached_id(record["user"]))
+            ), self.activity_statement(msg)]
+        elif op == "rank":
+            if not record["ranking"]:
+                return [(
+                    "DELETE FROM ballots WHERE message_id = ? AND user_id = ?", (msg, record["user"])
+                ), self.activity_statement(msg)]
+            return [(
+                "INSERT OR REPLACE INTO ballots VALUES (?, ?, ?)",
+                (msg, record["user"], json.dumps(record["ranking"]))
+            ), self.activity_statement(msg)]
+        elif op == "clear":
+            return [("DELETE FROM votes WHERE message_id = ?", (msg,))]
+        elif op == "reset":
+            return [("DELETE FROM votes WHERE message_id = ?", (msg,))] \
+                + self.vote_statements(msg, record["votes"])
+        elif op == "deactivate":
+            return [("UPDATE polls SET active = 0 WHERE message_id = ?", (msg,)), self.activity_statement(msg)]
+        elif op == "kill":
+            return [
+                ("DELETE FROM votes WHERE message_id = ?", (msg,)),
+                ("DELETE FROM ballots WHERE message_id = ?", (msg,)),
+                ("DELETE FROM polls WHERE message_id = ?", (msg,))
+            ]
+        raise ValueError(f"Unknown poll record {op}")
+
+    @staticmethod
+    def activity_statement(msg):
+        # Records are turned into statements as they happen, so now is
+        # when the vote changed.
+        return ("UPDATE polls SET last_activity = ? WHERE message_id = ?", (time.time(), msg))
+
+    @staticmethod
+    def vote_statements(msg, votes):
+        return [
+            ("INSERT OR IGNORE INTO votes VALUES (?, ?, ?)", (msg, option, caching.cached_id(user)))
+            for option, voters in enumerate(votes) for user in voters if user is not None
+        ]
+
+    @staticmethod
+    def ballot_statements(msg, ballots):
+        return [
+            ("INSERT OR REPLACE INTO ballots VALUES (?, ?, ?)", (msg, user_id, json.dumps(ranking)))
+            for user_id, ranking in ballots.items()
+        ]
+
+    def append(self, record):
+        statements = self.statements(record)
+        with self.lock:
+            self.pending += statements
+
+    def write_due(self):
+        return True
+
+    def prepare(self, polls):
+        return True if self.pending else None
+
+    def write(self, snapshot):
+        with self.write_lock:
+            with self.lock:
+                batch, self.pending = self.pending, []
+            if not batch:
+                return
+            try:
+                with self.writer:
+                    for sql, params in batch:
+                        self.writer.execute(sql, params)
+            except BaseException:
+                with self.lock:
+                    self.pending[:0] = batch
+                raise
+        if self.metrics is not None:
+            self.metrics.count("poll_store_statements", len(batch))
+            self.metrics.count("poll_store_transactions")
+
+    def load_votes(self, poll):
+        votes = [set() for _ in poll.options]
+        for option, user_id in self.reader.execute(
+            "SELECT option, user_id FROM votes WHERE message_id = ?", (poll.message_id,)
+        ):
+            votes[option].add(user_id)
+        return votes
+
+    def iter_votes(self, poll):
+        # Straight off the cursor, so a big poll's votes never have to be
+        # held all at once.
+        cursor = self.reader.execute(
+            "SELECT option, user_id FROM votes WHERE message_id = ? ORDER BY option, user_id",
+            (poll.message_id,)
+        )
+        try:
+            yield from cursor
+        finally:
+            cursor.close()
+
+    def load_ballots(self, poll):
+        return {
+            user_id: tuple(json.loads(ranking)) for user_id, ranking in self.reader.execute(
+                "SELECT user_id, ranking FROM ballots WHERE message_id = ?", (poll.message_id,)
+            )
+        }
+
+    def archive(self, caches):
+        statements = [
+            ("UPDATE polls SET archived = 1 WHERE message_id = ?", (caching.cached_id(cache["poll_message"]),))
+            for cache in caches
+        ]
+        with self.lock:
+            self.pending += statements
+        self.write(True)
+
+    def archived_indices(self):
+        return [index for index, in self.reader.execute("SELECT poll_index FROM polls WHERE archived")]
+
+    def load_archived(self, poll_index):
+        row = self.reader.execute(
+            f"SELECT {self.POLL_COLUMNS} FROM polls WHERE poll_index = ? AND archived", (poll_index,)
+        ).fetchone()
+        if row is None:
+            return None
+        votes = self.reader.execute("SELECT option, user_id FROM votes WHERE message_id = ?", (row[0],))
+        ballots = self.reader.execute("SELECT user_id, ranking FROM ballots WHERE message_id = ?", (row[0],))
+        return self.poll_cache(row, votes, ballots)
+
+    def drop_archived(self, poll_index):
+        subquery = "SELECT message_id FROM polls WHERE poll_index = ? AND archived"
+        with self.lock:
+            self.pending += [
+                (f"DELETE FROM votes WHERE message_id IN ({subquery})", (poll_index,)),
+                (f"DELETE FROM ballots WHERE message_id IN ({subquery})", (poll_index,)),
+                ("DELETE FROM polls WHERE poll_index = ? AND archived", (poll_index,))
+            ]
+
+    def close(self):
+        for connection in (self.writer, self.reader):
+            if connection is not None:
+                connection.close()
+        self.writer = self.reader = None
@@ -0,0 +1,195 @@
+import itertools
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# A ballot is a ranking: candidate indices, most preferred first, as many
+# as the voter cared to rank. With NumPy the ballots are packed into one
+# (voters x ranks) array and every count is a handful of array operations,
+# without it the reference implementations below count the same over the
+# lists. Both give the same results, ties included.
+# The counting functions take a list of rankings, or the array from
+# `ballot_array` or `BallotBox.snapshot` when NumPy is around.
+
+BLANK = -1
+
+def ballot_dtype(candidates):
+    return numpy.int8 if candidates < 127 else numpy.int16
+
+def ballot_array(ballots, candidates, ranks=None):
+    # Unranked places are BLANK. Rankings are short, so they're packed
+    # flat first and then scattered into the rows in one go.
+    if ranks is None:
+        ranks = max(map(len, ballots), default=0)
+    ranks = max(1, ranks)
+    dtype = ballot_dtype(candidates)
+    lengths = numpy.fromiter(map(len, ballots), dtype=numpy.intp, count=len(ballots))
+    flat = numpy.fromiter(
+        itertools.chain.from_iterable(ballots), dtype=dtype, count=int(lengths.sum())
+    )
+    array = numpy.full((len(ballots), ranks), BLANK, dtype=dtype)
+    array[numpy.arange(ranks) < lengths[:, None]] = flat
+    return array
+
+def packed(ballots, candidates):
+    if isinstance(ballots, numpy.ndarray):
+        return ballots
+    return ballot_array(ballots, candidates)
+
+class BallotBox:
+    # Every voter's ranking and, with NumPy, the same ballots as the rows of
+    # one array that is kept up to date in place, so that counting a large
+    # electorate doesn't start with packing it. A withdrawn ballot leaves a
+    # blank row behind for the next voter, blank rows count for nobody.
+    def __init__(self, candidates, rankings=None):
+        self.candidates = candidates
+        self.rankings = dict(rankings or {})
+        self.rows = {}
+        self.free = []
+        self.array = None
+        self.size = 0
+        if numpy is not None and self.rankings:
+            self.rows = {voter: row for row, voter in enumerate(self.rankings)}
+            self.array = ballot_array(list(self.rankings.values()), candidates, candidates)
+            self.size = len(self.rows)
+
+    def __len__(self):
+        return len(self.rankings)
+
+    def put(self, voter, ranking):
+        ranking = tuple(ranking)
+        if not ranking:
+            self.discard(voter)
+            return
+        self.rankings[voter] = ranking
+        if numpy is None:
+            return
+        row = self.rows.get(voter)
+        if row is None:
+            row = self.free.pop() if self.free else self.allocate_row()
+            self.rows[voter] = row
+        self.array[row] = BLANK
+        self.array[row, :len(ranking)] = ranking
+
+    def discard(self, voter):
+        if self.rankings.pop(voter, None) is None or numpy is None:
+            return
+        row = self.rows.pop(voter)
+        self.array[row] = BLANK
+        self.free.append(row)
+
+    def allocate_row(self):
+        if self.array is None or self.size == len(self.array):
+            grown = numpy.full(
+                (max(16, 2 * self.size), max(1, self.candidates)), BLANK,
+                dtype=ballot_dtype(self.candidates)
+            )
+            if self.array is not None:
+                grown[:self.size] = self.array[:self.size]
+            self.array = grown
+        self.size += 1
+        return self.size - 1
+
+    def snapshot(self):
+        # The ballots as they are now, for counting in another thread while
+        # this box keeps changing.
+        if numpy is None or self.array is None:
+            return list(self.rankings.values())
+        return self.array[:self.size].copy()
+
+def pick_loser(counts, eliminated):
+    # The remaining candidate with the fewest votes, ties go against the
+    # later one.
+    remaining = [c for c in range(len(counts)) if not eliminated[c]]
+    return min(reversed(remaining), key=lambda c: counts[c])
+
+def instant_runoff(ballots, candidates):
+    # Returns the winner (None if nobody ranked anyone) and the rounds, each
+    # as (votes per candidate, candidate eliminated or None in the last one).
+    if numpy is None:
+        return instant_runoff_reference(ballots, candidates)
+    array = packed(ballots, candidates)
+    if not (array[:, 0] != BLANK).any():
+        return None, []
+    ranks = array.shape[1]
+    eliminated = numpy.zeros(candidates, dtype=bool)
+    # Every ballot counts for its highest ranked candidate still in the
+    # race, `position` is where that is on the ballot.
+    position = numpy.zeros(len(array), dtype=numpy.intp)
+    top = array[:, 0].astype(numpy.intp)
+    rounds = []
+    while True:
+        counts = numpy.bincount(top[top != BLANK], minlength=candidates)
+        remaining = candidates - int(eliminated.sum())
+        if counts.max() * 2 > counts.sum() or remaining == 1:
+            winner = int(numpy.argmax(numpy.where(eliminated, -1, counts)))
+            rounds.append((counts.tolist(), None))
+            return winner, rounds
+        loser = pick_loser(counts.tolist(), eliminated)
+        rounds.append((counts.tolist(), loser))
+        eliminated[loser] = True
+        # Only the loser's ballots move on, down to their next choice still
+        # in the race or off the end.
+        moving = numpy.flatnonzero(top == loser)
+        while moving.size:
+            position[moving] += 1
+            exhausted = position[moving] >= ranks
+            top[moving] = array[moving, numpy.minimum(position[moving], ranks - 1)]
+            top[moving[exhausted]] = BLANK
+            choices = top[moving]
+            moving = moving[(choices != BLANK) & eliminated[choices]]
+
+def borda(ballots, candidates):
+    # A candidate ranked r-th (from 0) gets candidates - 1 - r points,
+    # unranked ones none.
+    if numpy is None:
+        return borda_reference(ballots, candidates)
+    array = packed(ballots, candidates)
+    points = numpy.broadcast_to(candidates - 1 - numpy.arange(array.shape[1]), array.shape)
+    ranked = array != BLANK
+    scores = numpy.bincount(array[ranked], weights=points[ranked], minlength=candidates)
+    return [int(score) for score in scores]
+
+def approval(ballots, candidates):
+    # Every candidate on a ballot counts as approved by that voter.
+    if numpy is None:
+        return approval_reference(ballots, candidates)
+    array = packed(ballots, candidates)
+    return numpy.bincount(array[array != BLANK], minlength=candidates).tolist()
+
+def instant_runoff_reference(ballots, candidates):
+    if not any(ballots):
+        return None, []
+    eliminated = [False] * candidates
+    rounds = []
+    while True:
+        counts = [0] * candidates
+        for ballot in ballots:
+            for candidate in ballot:
+                if not eliminated[candidate]:
+                    counts[candidate] += 1
+                    break
+        remaining = eliminated.count(False)
+        if max(counts) * 2 > sum(counts) or remaining == 1:
+            winner = max(range(candidates), key=lambda c: -1 if eliminated[c] else counts[c])
+            rounds.append((counts, None))
+            return winner, rounds
+        loser = pick_loser(counts, eliminated)
+        rounds.append((counts, loser))
+        eliminated[loser] = True
+
+def borda_reference(ballots, candidates):
+    scores = [0] * candidates
+    for ballot in ballots:
+        for rank, candidate in enumerate(ballot):
+            scores[candidate] += candidates - 1 - rank
+    return scores
+
+def approval_reference(ballots, candidates):
+    counts = [0] * candidates
+    for ballot in ballots:
+        for candidate in ballot:
+            counts[candidate] += 1
+    return counts
@@ -1,3 +1,4 @@
+import itertools
 
 def is_admin(member):
     return member.server_permissions.administrator or member.id == "199218932496859137"
@@ -6,3 +7,46 @@ def shortened(cont, charlim=64):
     if len(cont) > charlim or len(cont.split("\n"))>1: 
         cont = cont.split("\n")[0][:charlim] + "..."
     return cont
+
+MESSAGE_LIMIT = 2000
+
+def paginate(lines, limit=MESSAGE_LIMIT, separator=", "):
+    # Packs lines into as few messages as Discord's length limit allows. A
+    # line that doesn't fit is broken up between its items, filling up the
+    # current message before spilling into the next.
+    pages, page = [], None
+    for line in lines:
+        while line is not None:
+            room = limit if page is None else limit - len(page) - 1
+            piece, line = split_line(line, room, separator, force=page is None)
+            if piece is not None:
+                page = piece if page is None else page + "\n" + piece
+            if line is not None:
+                pages.append(page)
+                page = None
+    if page is not None:
+        pages.append(page)
+    return pages
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+def split_line(line, room, separator=", ", force=False):
+    # Returns the part of `line` that fits into `room` characters and the
+    # rest (None once it all fits). Without a separator to break at, the
+    # line is only cut mid-item when `force` is set.
+    if len(line) <= room:
+        return line, None
+    end = separator.rstrip()
+    cut = line.rfind(separator, 0, room - len(end) + len(separator))
+    if cut > 0:
+        # The separator's punctuation stays at the end of the piece.
+        return line[:cut] + end, line[cut + len(separator):]
+    if force:
+        return line[:room], line[room:]
+    return None, line